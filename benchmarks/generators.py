@@ -0,0 +1,51 @@
+"""Synthetic graphs for the benchmarks.
+
+Every generator returns the node count and the edge list as two arrays of
+tail and head indices.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+Workload = Tuple[int, np.ndarray, np.ndarray]
+
+
+def random_dag(n: int, degree: float = 1.5, reach: int = 20, seed: int = 0) -> Workload:
+    """Edges from each node to one of the next `reach` nodes, so that the
+    graph is acyclic and its depth grows with its size"""
+    rng = np.random.default_rng(seed)
+    m = int(n * degree)
+    sources = rng.integers(0, max(n - 1, 1), m)
+    targets = np.minimum(sources + rng.integers(1, reach + 1, m), n - 1)
+    keep = sources != targets
+    return n, sources[keep], targets[keep]
+
+
+def grid(n: int) -> Workload:
+    """Square lattice with edges going right and down"""
+    side = max(int(np.sqrt(n)), 1)
+    ids = np.arange(side * side).reshape(side, side)
+    sources = np.concatenate([ids[:, :-1].ravel(), ids[:-1, :].ravel()])
+    targets = np.concatenate([ids[:, 1:].ravel(), ids[1:, :].ravel()])
+    return side * side, sources, targets
+
+
+def star(n: int) -> Workload:
+    """One hub with an edge to every other node"""
+    targets = np.arange(1, n)
+    return n, np.zeros(n - 1, dtype=np.int64), targets
+
+
+def chain(n: int) -> Workload:
+    """A single path through all nodes"""
+    sources = np.arange(n - 1)
+    return n, sources, sources + 1
+
+
+WORKLOADS = {
+    "random_dag": random_dag,
+    "grid": grid,
+    "star": star,
+    "chain": chain,
+}
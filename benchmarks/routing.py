@@ -0,0 +1,120 @@
+"""Time obstacle routing of many edges among many boxes.
+
+    python -m benchmarks.routing --edges 3000 --boxes 200
+
+Every edge joins two random boxes, scattered at random or packed in a grid,
+and is routed from scratch, bitmap included. The run fails if routing all
+of them takes longer than the budget.
+"""
+
+import argparse
+import random
+import sys
+from typing import List, Tuple
+
+from pytermgraph.canvas import Canvas
+from pytermgraph.object import Box, Edge
+from pytermgraph.support import Direction, Position, Routing
+
+from .run import REPEAT, measure
+
+WIDTH, HEIGHT = 500, 200
+BOX_WIDTH, BOX_HEIGHT = 9, 5
+
+# Seconds allowed to route all edges of a layout
+BUDGET = 1.0
+
+
+def scattered(canvas: Canvas, count: int, rng: random.Random) -> List[Box]:
+    """Boxes at random positions, some of them overlapping"""
+    return [
+        canvas.add_box(
+            BOX_WIDTH,
+            BOX_HEIGHT,
+            Position(
+                rng.randint(0, WIDTH - BOX_WIDTH), rng.randint(0, HEIGHT - BOX_HEIGHT)
+            ),
+            str(i),
+        )
+        for i in range(count)
+    ]
+
+
+def packed(canvas: Canvas, count: int, rng: random.Random) -> List[Box]:
+    """As many boxes as fit in a grid with narrow gaps between them"""
+    boxes = []
+    for x in range(2, WIDTH - BOX_WIDTH, BOX_WIDTH + 4):
+        for y in range(2, HEIGHT - BOX_HEIGHT, BOX_HEIGHT + 5):
+            boxes.append(
+                canvas.add_box(BOX_WIDTH, BOX_HEIGHT, Position(x, y), f"{x},{y}")
+            )
+    return boxes
+
+
+LAYOUTS = {"scattered": scattered, "packed": packed}
+
+
+def build(layout: str, boxes: int, edges: int, seed: int) -> Tuple[Canvas, List[Edge]]:
+    rng = random.Random(seed)
+    canvas = Canvas(WIDTH, HEIGHT, routing=Routing.OBSTACLE)
+    placed = LAYOUTS[layout](canvas, boxes, rng)
+    drawn = [
+        canvas.draw_edge_boxes(
+            *rng.sample(placed, 2), start_direction=Direction.VERTICAL
+        )
+        for _ in range(edges)
+    ]
+    canvas.sync_index()
+    return canvas, drawn
+
+
+def blocked(canvas: Canvas, edge: Edge) -> bool:
+    """Whether the route of the edge crosses a box between its ends"""
+    occupancy = canvas.router.occupancy
+    path = edge.route()
+    ends = {(edge.start.x, edge.start.y), (edge.end.x, edge.end.y)}
+    for a, b in zip(path, path[1:]):
+        for x in range(min(a.x, b.x), max(a.x, b.x) + 1):
+            for y in range(min(a.y, b.y), max(a.y, b.y) + 1):
+                if (x, y) not in ends and occupancy[y, x]:
+                    return True
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--layouts", nargs="+", default=list(LAYOUTS), choices=list(LAYOUTS)
+    )
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--edges", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--budget", type=float, default=BUDGET)
+    args = parser.parse_args(argv)
+
+    over = 0
+    print(f"{'layout':<10} {'boxes':>6} {'edges':>6} {'seconds':>8} {'blocked':>8}")
+    for layout in args.layouts:
+        canvas, edges = build(layout, args.boxes, args.edges, args.seed)
+        router = canvas.router
+
+        def route():
+            router.occupancy = None
+            for e in edges:
+                e._path = None
+            router.route_all(edges)
+
+        seconds, _ = measure(route, False, args.repeat)
+        boxes = sum(isinstance(o, Box) for o in canvas.render_list)
+        stuck = sum(blocked(canvas, e) for e in edges)
+        print(f"{layout:<10} {boxes:>6} {len(edges):>6} {seconds:>8.3f} {stuck:>8}")
+        over += seconds > args.budget
+
+    if over:
+        print(f"{over} layout(s) over the budget of {args.budget}s")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Time every stage of a render on synthetic graphs of growing size.
+
+    python -m benchmarks.run --sizes 100 300 1000 --output results.json
+    python -m benchmarks.run --compare results.json
+
+Results are written as JSON, together with the fitted scaling exponent of
+every stage, so that runs on different commits can be compared.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from pytermgraph.graph import Graph
+from pytermgraph.layout import layered_layout
+from pytermgraph.object import Edge
+
+from .generators import WORKLOADS
+
+STAGES = [
+    "layout",
+    "place_anchors",
+    "route",
+    "render",
+    "to_string",
+]
+
+DEFAULT_SIZES = [100, 300, 1000, 3000]
+
+# Runs of every stage, of which the fastest is kept
+REPEAT = 5
+
+
+def measure(fn: Callable, memory: bool, repeat: int = REPEAT):
+    """Wall time of the fastest of several calls, and the peak traced
+    allocation of one more if asked"""
+    seconds = min(timeit.repeat(fn, number=1, repeat=repeat))
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def build_graph(n: int, sources: np.ndarray, targets: np.ndarray) -> Graph:
+    graph = Graph()
+    for i in range(n):
+        graph.add_node(i)
+    for tail, head in zip(sources.tolist(), targets.tolist()):
+        graph.add_edge(tail, head)
+    return graph
+
+
+def run_workload(
+    name: str, size: int, memory: bool, repeat: int = REPEAT
+) -> List[Dict]:
+    n, sources, targets = WORKLOADS[name](size)
+    graph = build_graph(n, sources, targets)
+    widths, heights = graph.node_sizes()
+
+    timings = {}
+    timings["layout"] = measure(
+        lambda: layered_layout(n, sources, targets, widths, heights), memory, repeat
+    )
+
+    # Everything below works on the drawn graph, with its edges placed and
+    # indexed so that no stage pays for the others
+    canvas = graph.draw()
+    canvas.sync_index()
+    boxes = [graph.boxes[i] for i in range(n)]
+
+    def place_anchors():
+        for box in boxes:
+            canvas.anchors_changed(box)
+        canvas.place_anchors()
+
+    timings["place_anchors"] = measure(place_anchors, memory, repeat)
+
+    edges = [o for o in canvas.render_list if isinstance(o, Edge)]
+
+    def route():
+        for e in edges:
+            # Drop the cached path, so that it is computed again
+            e._path = None
+            e.route()
+
+    timings["route"] = measure(route, memory, repeat)
+
+    def render():
+        canvas.invalidate()
+        canvas.render()
+
+    timings["render"] = measure(render, memory, repeat)
+    timings["to_string"] = measure(canvas.to_string, memory, repeat)
+
+    return [
+        {
+            "workload": name,
+            "size": size,
+            "nodes": n,
+            "edges": len(sources),
+            "cells": canvas.width * canvas.height,
+            "stage": stage,
+            "seconds": seconds,
+            "peak_bytes": peak,
+        }
+        for stage, (seconds, peak) in timings.items()
+    ]
+
+
+def scaling(results: List[Dict]) -> Dict[str, Dict[str, float]]:
+    """Exponent k of a time ~ edges^k fit, per workload and stage"""
+    curves: Dict[str, Dict[str, float]] = {}
+    for name in sorted({r["workload"] for r in results}):
+        curves[name] = {}
+        for stage in STAGES:
+            points = [
+                (r["edges"], r["seconds"])
+                for r in results
+                if r["workload"] == name and r["stage"] == stage
+            ]
+            points = [(e, s) for e, s in points if e > 0 and s > 0]
+            if len(points) < 2:
+                continue
+            x, y = np.log(np.array(points)).T
+            curves[name][stage] = float(np.polyfit(x, y, 1)[0])
+    return curves
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def report(results: List[Dict], curves: Dict[str, Dict[str, float]]):
+    print(f"{'workload':<12} {'size':>6} {'stage':<24} {'seconds':>10} {'peak MiB':>9}")
+    for r in results:
+        peak = "" if r["peak_bytes"] is None else f"{r['peak_bytes'] / 2**20:9.2f}"
+        print(
+            f"{r['workload']:<12} {r['size']:>6} {r['stage']:<24} "
+            f"{r['seconds']:>10.4f} {peak:>9}"
+        )
+    print()
+    print("Scaling exponent (time ~ edges^k):")
+    for name, stages in curves.items():
+        fitted = ", ".join(f"{stage} {k:.2f}" for stage, k in stages.items())
+        print(f"  {name}: {fitted}")
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float):
+    """Print the stages that got slower than the baseline by the threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {
+        (r["workload"], r["size"], r["stage"]): r["seconds"]
+        for r in baseline["results"]
+    }
+    print()
+    print(f"Compared with {baseline_path} ({baseline.get('commit')}):")
+    regressions = 0
+    for r in results:
+        old = before.get((r["workload"], r["size"], r["stage"]))
+        if not old:
+            continue
+        ratio = r["seconds"] / old
+        if ratio > threshold:
+            regressions += 1
+            print(
+                f"  slower: {r['workload']} {r['size']} {r['stage']} "
+                f"{old:.4f}s -> {r['seconds']:.4f}s ({ratio:.2f}x)"
+            )
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workloads", nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS)
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown ratio reported as a regression by --compare",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=REPEAT,
+        help="runs of every stage, of which the fastest is reported",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip peak memory measurements"
+    )
+    args = parser.parse_args(argv)
+
+    # Warm up imports and caches so the first measurement isn't skewed
+    run_workload(args.workloads[0], min(args.sizes), False, 1)
+
+    results = []
+    for name in args.workloads:
+        for size in args.sizes:
+            results += run_workload(name, size, not args.no_memory, args.repeat)
+
+    curves = scaling(results)
+    report(results, curves)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "sizes": args.sizes,
+                    "results": results,
+                    "scaling": curves,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+from .graph import Graph
+from .style import STYLES
+
+# Label Graphviz gives nodes by default, standing for the node name
+DEFAULT_LABEL = "\\N"
+
+
+def read_dot(text: str) -> Graph:
+    """Graph of the nodes and edges of a DOT document"""
+    # Imported here so that importing pytermgraph does not load Graphviz
+    import pygraphviz
+
+    agraph = pygraphviz.AGraph(string=text)
+    graph = Graph()
+    for node in agraph.nodes():
+        label = node.attr.get("label")
+        graph.add_node(str(node), None if label in (None, "", DEFAULT_LABEL) else label)
+    for tail, head in agraph.edges():
+        graph.add_edge(str(tail), str(head))
+    return graph
+
+
+def render_dot(text: str, style: str = "light") -> str:
+    """Lay a DOT document out and draw it as text"""
+    canvas = read_dot(text).draw()
+    canvas.render()
+    return canvas.to_string(STYLES[style])
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+
+# Bump whenever the layout engine changes its results, so that positions
+# computed by an older version are not reused
+LAYOUT_VERSION = 2
+
+Layout = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def layout_key(
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    widths: np.ndarray,
+    heights: np.ndarray,
+) -> str:
+    """Digest of everything the layout depends on: the topology and the
+    node sizes, but not the labels themselves"""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(np.array([LAYOUT_VERSION, n, len(sources)], dtype="<i8").tobytes())
+    for a in (sources, targets, widths, heights):
+        h.update(np.ascontiguousarray(a, dtype="<i8").tobytes())
+    return h.hexdigest()
+
+
+class LayoutCache:
+    """Computed layouts by content hash.
+
+    Recently used layouts are kept in memory. If a directory is given, every
+    layout is also written there, one compressed file per key, so that other
+    processes and later runs can reuse it.
+    """
+
+    def __init__(self, directory: str | None = None, capacity: int = 128) -> None:
+        self.directory = directory
+        self.capacity = capacity
+        self.entries: "OrderedDict[str, Layout]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key: str) -> Layout | None:
+        layout = self.entries.get(key)
+        if layout is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return layout
+
+        if self.directory is not None:
+            try:
+                with np.load(self.path(key)) as data:
+                    layout = (
+                        data["x"].astype(np.int64),
+                        data["y"].astype(np.int64),
+                        data["layer"].astype(np.int64),
+                        data["reversed"],
+                        data["bend_offsets"].astype(np.int64),
+                        data["bends"].astype(np.int64),
+                    )
+            except (OSError, KeyError, ValueError):
+                layout = None
+            if layout is not None:
+                self.remember(key, layout)
+                self.hits += 1
+                return layout
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, layout: Layout):
+        self.remember(key, layout)
+        if self.directory is None:
+            return
+
+        x, y, layer, reversed, bend_offsets, bends = layout
+        # Write to a temporary file first, so that readers never see a
+        # partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    x=x.astype(np.int32),
+                    y=y.astype(np.int32),
+                    layer=layer.astype(np.int32),
+                    reversed=reversed,
+                    bend_offsets=bend_offsets.astype(np.int32),
+                    bends=bends.astype(np.int32),
+                )
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def remember(self, key: str, layout: Layout):
+        self.entries[key] = layout
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
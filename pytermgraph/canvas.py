@@ -1,9 +1,18 @@
+import os
+import tempfile
 from enum import Enum
 from sys import is_finalizing
-from typing import List
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Sequence, Set
 import numpy as np
 
 from .object import Direction, Position, Box, Edge, RenderObject
+from .router import ObstacleRouter
+from .spatial import SpatialIndex
+from .sprite import Sprite, SpriteCache
+from .stats import WRAPPED, RenderStats, instrument, uninstrument
+from .style import CONTINUATION, LIGHT, Style
+from .support import LINK_DOWN, LINK_LEFT, LINK_RIGHT, LINK_UP, Rect, Routing
+from .text import text_cells, wide_halves
 
 # ASCI art characters for creating diagrams
 # ## Characters:
@@ -51,40 +60,358 @@ from .object import Direction, Position, Box, Edge, RenderObject
 
 
 class Canvas:
-    def __init__(self, width, height, fill=" "):
+    def __init__(
+        self,
+        width,
+        height,
+        fill=" ",
+        routing=Routing.MANHATTAN,
+        style=LIGHT,
+        viewport: Rect | None = None,
+        dtype=np.uint32,
+        storage: str | None = None,
+    ):
         self.width = width
         self.height = height
         self.fill = fill
+        # Characters of the line and arrow glyphs, chosen at output
+        self.style = style
+        # Default routing of new edges
+        self.routing = routing
+        self.router = ObstacleRouter(self)
 
-        self.render_list: List[RenderObject] = []
+        # Objects in stacking order. Removed objects are dropped from the list
+        # on its next read, so that removing many at once stays linear.
+        self._render_list: List[RenderObject] = []
+        self.removed: Set[RenderObject] = set()
+        self.next_order = 0
 
-    def render_canvas(self):
-        # +1 in the width the newline char
-        self.array = np.array(
-            [[self.fill for x in range(self.width + 1)] for _ in range(self.height)]
+        # Objects by the cells they cover, and edges by the boxes they join
+        self.index = SpatialIndex()
+        self.incident: Dict[RenderObject, Dict[Edge, None]] = {}
+        # Set when obstacle-routed edges may have changed shape
+        self.stale_routes = False
+        # Boxes whose anchors must be placed again, and edges added since that
+        # wait for their anchors before being indexed. Both are handled by
+        # place_anchors in one pass before rendering.
+        self.pending_anchors: Dict[Box, None] = {}
+        self.unplaced: Dict[Edge, None] = {}
+
+        # Part of the canvas backed by cells. Objects are laid out on the whole
+        # canvas, but only the viewport is rendered.
+        self.viewport = self.bounds() if viewport is None else viewport
+
+        # One integer per cell, allocated once and reused by every render.
+        # Cells hold code points, or glyph IDs from style.py that are turned
+        # into characters on output. The newline column is added at
+        # serialization time. With a uint16 dtype, characters outside the
+        # Basic Multilingual Plane are stored as U+FFFD.
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in CELL_DTYPES:
+            # Smaller cells could not even hold U+FFFD
+            raise ValueError(f"cell dtype must be uint16 or uint32, not {self.dtype}")
+        # If given, the cells are kept in this .npy file, memory-mapped rather
+        # than held in memory
+        self.storage = storage
+        # Lines drawn with connect() leave LINK_* bits in links instead of
+        # glyphs, so that crossing and touching lines merge into junctions.
+        # The bits are copied into the cells at the end of every render, as
+        # they are also the glyph IDs of the lines.
+        self.array, self.links = self.allocate(self.viewport)
+
+        # Drawing primitives only write inside the clip rectangle, which is
+        # always within the viewport
+        self.clip = self.viewport
+
+        # Areas that changed since the last render. A full render is needed
+        # until the array has been filled once.
+        self.dirty: List[Rect] = []
+        self.needs_full_render = True
+
+        # Cells of rendered boxes, reused by boxes that look the same. None
+        # draws every box from scratch.
+        self.sprites: SpriteCache | None = SpriteCache()
+
+        # Set while the canvas is instrumented, see instrument()
+        self.stats: RenderStats | None = None
+
+    def __getstate__(self):
+        # Objects and settings only, the cells are re-rendered wherever the
+        # canvas is unpickled
+        self.compact()
+        state = self.__dict__.copy()
+        state["array"] = None
+        state["links"] = None
+        state["storage"] = None
+        state.pop("shared_memory", None)
+        for name in WRAPPED:
+            state.pop(name, None)
+        state["stats"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.array, self.links = self.allocate(self.viewport)
+        self.needs_full_render = True
+        for o in self.render_list:
+            if isinstance(o, Edge):
+                for anchor in (o.start_anchor, o.end_anchor):
+                    if anchor is not None:
+                        anchor.edge = o
+
+    @property
+    def render_list(self) -> List[RenderObject]:
+        self.compact()
+        return self._render_list
+
+    @render_list.setter
+    def render_list(self, objects: List[RenderObject]):
+        self._render_list = objects
+        self.removed.clear()
+
+    def compact(self):
+        """Drop removed objects from the render list"""
+        if self.removed:
+            self._render_list = [o for o in self._render_list if o not in self.removed]
+            self.removed.clear()
+
+    def allocate(self, viewport: Rect):
+        shape = (viewport.height, viewport.width)
+        if self.storage is None or viewport.is_empty():
+            array = np.full(shape, self.code(self.fill), dtype=self.dtype)
+            return array, np.zeros(shape, dtype=np.uint8)
+
+        array = np.lib.format.open_memmap(
+            self.storage, mode="w+", dtype=self.dtype, shape=shape
         )
+        array.fill(self.code(self.fill))
+        # The links are scratch space, kept in an unnamed file next to the
+        # cells that goes away with the array
+        directory = os.path.dirname(os.path.abspath(self.storage))
+        with tempfile.TemporaryFile(dir=directory) as f:
+            links = np.memmap(f, dtype=np.uint8, mode="w+", shape=shape)
+        return array, links
 
-        for i in range(self.height):
-            self.array[i][self.width] = "\n"
+    def flush(self):
+        """Write memory-mapped cells out to their file"""
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
 
-    def add_box(self, width: int, height: int, position: Position, label: str) -> "Box":
-        assert position.x + width <= self.width
-        assert position.y + height <= self.height
+    def code(self, char: str) -> int:
+        code = ord(char)
+        return code if code <= np.iinfo(self.dtype).max else REPLACEMENT
+
+    def bounds(self) -> Rect:
+        return Rect(0, 0, self.width, self.height)
+
+    def render_canvas(self):
+        self.array.fill(self.code(self.fill))
+        self.links.fill(0)
+
+    def invalidate(self, rect: Rect | None = None):
+        """Schedule an area for re-rendering, or the whole canvas if no area is given"""
+        if rect is None:
+            self.needs_full_render = True
+            return
+        rect = rect.intersection(self.viewport)
+        if not rect.is_empty():
+            self.dirty.append(rect)
+
+    def reindex(self, obj: RenderObject):
+        if obj in self.index:
+            self.index.update(obj, obj.parts())
+
+    def routes_changed(self):
+        self.stale_routes = True
+        self.invalidate()
+
+    def anchors_changed(self, box: Box):
+        self.pending_anchors[box] = None
+
+    def place_anchors(self):
+        """Place all requested anchors and move the edge ends onto them"""
+        if not self.pending_anchors:
+            return
+        boxes = list(self.pending_anchors)
+        self.pending_anchors.clear()
+
+        edges: Dict[Edge, None] = {}
+        for box in boxes:
+            box.place_anchors()
+            edges.update(dict.fromkeys(self.edges_of(box)))
 
+        unplaced = self.unplaced
+        self.unplaced = {}
+        moved = []
+        for edge in edges:
+            start, end = edge.start, edge.end
+            if edge.start_anchor is not None:
+                start = self.to_canvas_pos(
+                    edge.start_object, edge.start_anchor.position
+                )
+            if edge.end_anchor is not None:
+                end = self.to_canvas_pos(edge.end_object, edge.end_anchor.position)
+
+            if edge in unplaced:
+                edge._start = edge._position = start
+                edge._end = end
+                moved.append(edge)
+            elif start != edge.start or end != edge.end:
+                # Where the edge was drawn is repainted
+                edge.invalidate()
+                edge._start = edge._position = start
+                edge._end = end
+                edge._path = None
+                moved.append(edge)
+
+        # Routed in one go before being indexed
+        self.router.route_all(moved)
+        for edge in moved:
+            if edge in unplaced:
+                self.index.insert(edge, edge.parts())
+            else:
+                self.reindex(edge)
+            edge.invalidate()
+
+    def sync_index(self):
+        self.place_anchors()
+        if not self.stale_routes:
+            return
+        self.stale_routes = False
+        edges = [
+            o
+            for o in self.render_list
+            if isinstance(o, Edge) and o.routing == Routing.OBSTACLE
+        ]
+        self.router.route_all(edges)
+        for edge in edges:
+            self.reindex(edge)
+
+    def add(self, obj: RenderObject):
+        obj.order = self.next_order
+        self.next_order += 1
+        if obj in self.removed:
+            # Put back on top, not where it was
+            self.compact()
+        self._render_list.append(obj)
+
+        if isinstance(obj, Edge):
+            for box in {obj.start_object, obj.end_object}:
+                if box is not None:
+                    self.incident.setdefault(box, {})[obj] = None
+            if any(
+                b in self.pending_anchors for b in (obj.start_object, obj.end_object)
+            ):
+                # Indexed once its ends are known
+                self.unplaced[obj] = None
+                return
+
+        self.index.insert(obj, obj.parts())
+        obj.invalidate()
+
+    def remove(self, obj: RenderObject, keep_routes: bool = False):
+        self.removed.add(obj)
+        if obj in self.unplaced:
+            del self.unplaced[obj]
+        else:
+            obj.invalidate()
+            self.index.remove(obj)
+
+        if isinstance(obj, Edge):
+            for box in {obj.start_object, obj.end_object}:
+                if box is not None:
+                    del self.incident[box][obj]
+            # Free the anchors, the remaining ones are re-spaced
+            for anchor in (obj.start_anchor, obj.end_anchor):
+                if anchor is not None:
+                    anchor.obj.anchors[anchor.side].remove(anchor)
+                    self.anchors_changed(anchor.obj)
+        if isinstance(obj, Box):
+            if keep_routes:
+                self.router.obstacles_changed([])
+            else:
+                self.router.invalidate()
+
+    def clear(self):
+        """Remove every object"""
+        self.render_list = []
+        self.index = SpatialIndex()
+        self.incident.clear()
+        self.pending_anchors.clear()
+        self.unplaced.clear()
+        self.router.invalidate()
+        self.invalidate()
+
+    def resize(self, width: int, height: int):
+        if (width, height) == (self.width, self.height):
+            return
+        full = self.viewport == self.bounds()
+        self.width = width
+        self.height = height
+        self.router.obstacles_changed([])
+        if full:
+            self.set_viewport(self.bounds())
+        self.invalidate()
+
+    def query(self, rect: Rect) -> List[RenderObject]:
+        """Objects overlapping the area, in stacking order"""
+        self.sync_index()
+        return sorted(self.index.query(rect), key=lambda o: o.order)
+
+    def object_at(self, x: int, y: int) -> RenderObject | None:
+        """Topmost object drawn into the cell"""
+        self.sync_index()
+        hits = [o for o in self.index.at(x, y) if o.covers(x, y)]
+        return max(hits, key=lambda o: o.order, default=None)
+
+    def edges_of(self, box: Box) -> List[Edge]:
+        return list(self.incident.get(box, ()))
+
+    def add_box(self, width: int, height: int, position: Position, label: str) -> "Box":
         box = Box(self, width, height, position, label)
 
-        self.render_list.append(box)
+        self.add(box)
+        self.router.obstacles_changed([(box, box.bounds())])
         return box
 
+    def add_boxes(
+        self,
+        widths: Sequence[int],
+        heights: Sequence[int],
+        positions: Iterable[Position],
+        labels: Sequence[str],
+    ) -> List[Box]:
+        """Add many boxes at once, invalidating the canvas only once"""
+        boxes = []
+        for width, height, position, label in zip(widths, heights, positions, labels):
+            box = Box(self, width, height, position, label)
+            box.order = self.next_order
+            self.next_order += 1
+            self.index.insert(box, box.parts())
+            boxes.append(box)
+
+        self._render_list.extend(boxes)
+        self.router.obstacles_changed([(box, box.bounds()) for box in boxes])
+        self.invalidate()
+        return boxes
+
     def add_edge(
         self,
         start: Position,
         end: Position,
         start_direction: Direction = Direction.HORIZONTAL,
         end_direction: Direction = Direction.VERTICAL,
+        routing: Routing | None = None,
     ) -> Edge:
-        edge = Edge(self, start, end, start_direction, end_direction)
-        self.render_list.append(edge)
+        edge = Edge(
+            self,
+            start,
+            end,
+            start_direction,
+            end_direction,
+            routing=routing or self.routing,
+        )
+        self.add(edge)
 
         return edge
 
@@ -94,84 +421,468 @@ class Canvas:
         box2: Box,
         start_direction: Direction = Direction.HORIZONTAL,
         end_direction: Direction = Direction.VERTICAL,
+        routing: Routing | None = None,
+        start_side: Direction = Direction.DOWN,
+        end_side: Direction = Direction.UP,
     ) -> Edge:
         assert box1.canvas == self
         assert box2.canvas == self
 
-        anchor1 = box1.create_anchor(Direction.DOWN)
-        anchor2 = box2.create_anchor(Direction.UP)
-
-        print("A anchor")
-        for a in box1.anchors[Direction.DOWN]:
-            print(a.position.__dict__)
-
-        print("B anchor")
-        for a in box2.anchors[Direction.UP]:
-            print(a.position.__dict__)
-
-        center1 = self.to_canvas_pos(box1, anchor1.position)
-        center2 = self.to_canvas_pos(box2, anchor2.position)
-
-        for r in self.render_list:
-            if isinstance(r, Edge):
-                if not r.start_object or not r.end_object:
-                    continue
-                if r.start_object == box1:
-                    r.start = self.to_canvas_pos(
-                        box1, box1.anchors[Direction.DOWN][0].position
-                    )
-
-                    print(r.end.__dict__)
-                if r.end_object == box2:
-                    r.end = self.to_canvas_pos(
-                        box2, box2.anchors[Direction.UP][0].position
-                    )
-                    print(r.end.__dict__)
-
-        edge = Edge(self, center1, center2, start_direction, end_direction, box1, box2)
-        self.render_list.append(edge)
+        edge = self.box_edge(
+            box1, box2, start_direction, end_direction, routing, start_side, end_side
+        )
+        self.add(edge)
+        return edge
+
+    def draw_edges_between(
+        self,
+        starts: Sequence[Box],
+        ends: Sequence[Box],
+        start_sides: Sequence[Direction],
+        end_sides: Sequence[Direction],
+        start_direction: Direction = Direction.HORIZONTAL,
+        end_direction: Direction = Direction.VERTICAL,
+        routing: Routing | None = None,
+        bends: Sequence[List[Position]] | None = None,
+    ) -> List[Edge]:
+        """Join many pairs of boxes at once, like draw_edge_boxes. Bends,
+        one list per edge, are points the edges go through on the way."""
+        edges = []
+        for i, (box1, box2, start_side, end_side) in enumerate(
+            zip(starts, ends, start_sides, end_sides)
+        ):
+            edge = self.box_edge(
+                box1,
+                box2,
+                start_direction,
+                end_direction,
+                routing,
+                start_side,
+                end_side,
+            )
+            if bends is not None:
+                edge.bends = bends[i]
+            edge.order = self.next_order
+            self.next_order += 1
+            for box in {box1, box2}:
+                self.incident.setdefault(box, {})[edge] = None
+            edges.append(edge)
+
+        # Indexed, and drawn, once their anchors are placed
+        self._render_list.extend(edges)
+        self.unplaced.update(dict.fromkeys(edges))
+        return edges
+
+    def box_edge(
+        self,
+        box1: Box,
+        box2: Box,
+        start_direction: Direction,
+        end_direction: Direction,
+        routing: Routing | None,
+        start_side: Direction,
+        end_side: Direction,
+    ) -> Edge:
+        # Anchors are only requested here. They are placed, and the edge
+        # ends moved onto them, for all edges at once before rendering.
+        edge = Edge(
+            self,
+            self.to_canvas_pos(box1, box1.anchor_position(start_side, 0, 1)),
+            self.to_canvas_pos(box2, box2.anchor_position(end_side, 0, 1)),
+            start_direction,
+            end_direction,
+            box1,
+            box2,
+            routing or self.routing,
+        )
+        edge.start_anchor = box1.request_anchor(start_side, edge)
+        edge.end_anchor = box2.request_anchor(end_side, edge)
         return edge
 
     def to_canvas_pos(self, obj: RenderObject, pos: Position):
         return obj.position + pos
 
     def render(self):
-        self.render_canvas()
-        for o in self.render_list:
+        self.sync_index()
+        rects = []
+        if not self.needs_full_render:
+            rects = merge_rects(self.dirty, self.viewport)
+            area = sum(r.width * r.height for r in rects)
+            viewport = self.viewport.width * self.viewport.height
+            if len(rects) > FULL_RENDER_RECTS or area > FULL_RENDER_AREA * viewport:
+                self.needs_full_render = True
+        if self.needs_full_render:
+            self.render_canvas()
+            if self.viewport == self.bounds():
+                self.render_objects(self.render_list)
+            else:
+                self.render_objects(self.query(self.viewport))
+            self.resolve_links(self.viewport)
+            self.needs_full_render = False
+            self.dirty.clear()
+            return
+
+        # Only clear and redraw what intersects the changed areas. Objects are
+        # clipped to each area so that stacking order outside it is untouched.
+        for rect in rects:
+            self.clip = rect
+            self.fill_rect(rect.x, rect.y, rect.width, rect.height, self.fill)
+            self.render_objects(self.query(rect))
+            self.resolve_links(rect)
+        self.clip = self.viewport
+        self.dirty.clear()
+
+    def set_viewport(self, viewport: Rect):
+        """Back another part of the canvas with cells. Everything in it is
+        rendered again on the next render."""
+        viewport = viewport.intersection(self.bounds())
+        if viewport == self.viewport:
+            return
+        if (viewport.width, viewport.height) != (
+            self.viewport.width,
+            self.viewport.height,
+        ):
+            self.array, self.links = self.allocate(viewport)
+        self.viewport = viewport
+        self.clip = viewport
+        self.dirty.clear()
+        self.invalidate()
+
+    def render_viewport(self, x: int, y: int, width: int, height: int):
+        """Render only the given window of the canvas.
+
+        Only the window is allocated, so the canvas itself can be far larger
+        than what fits in memory. Moving the window re-renders it.
+        """
+        self.set_viewport(Rect(x, y, width, height))
+        self.render()
+
+    def render_objects(self, objects: List[RenderObject]):
+        for o in objects:
             o.render()
 
-    def draw(self, text: str, position: Position, offset: Position = Position(0, 0)):
-        assert 0 <= position.x + offset.x <= self.width
-        assert 0 <= position.y + offset.y <= self.height
+    def instrument(
+        self,
+        stats: RenderStats | None = None,
+        on_object: Callable[[RenderObject, float], None] | None = None,
+    ) -> RenderStats:
+        """Start counting drawing calls and timing renders.
+
+        on_object, if given, is called with every object rendered and the
+        seconds it took. Nothing is counted, and nothing slows down, until
+        this is called.
+        """
+        self.uninstrument()
+        self.stats = stats or RenderStats()
+        instrument(self, self.stats, on_object)
+        return self.stats
 
-        for idx, c in enumerate(text):
-            self.draw_char(c, Position(position.x + idx, position.y), offset)
+    def uninstrument(self):
+        uninstrument(self)
+        self.stats = None
+
+    def resolve_links(self, rect: Rect):
+        """Replace every linked cell in the area by its line glyph"""
+        # In blocks of rows, so that the mask stays small on large canvases
+        rows = max(1, BLOCK_CELLS // max(rect.width, 1))
+        for y in range(rect.y, rect.bottom, rows):
+            area = self.area(rect.x, y, rect.right, min(y + rows, rect.bottom))
+            links = self.links[area]
+            np.copyto(self.array[area], links, where=links != 0)
+
+    def draw(self, text: str, position: Position, offset: Position = Position(0, 0)):
+        x = position.x + offset.x
+        y = position.y + offset.y
+        clip = self.clip
+        if not clip.y <= y < clip.bottom:
+            return
+        cells = text_cells(text)
+        lo = max(x, clip.x)
+        hi = min(x + len(cells), clip.right)
+        if lo < hi:
+            area = self.area(lo, y, hi, y + 1)
+            codes = cells[lo - x : hi - x]
+            if self.dtype.itemsize < 4:
+                codes = np.where(codes > np.iinfo(self.dtype).max, REPLACEMENT, codes)
+            self.array[area] = codes
+            # Halves of wide characters cut by the viewport are blanked. Other
+            # clips are parts of the viewport drawn separately, and the other
+            # half is drawn with its own part.
+            row = self.array[area[0].start]
+            if lo == self.viewport.x and codes[0] == CONTINUATION:
+                row[0] = self.code(" ")
+            if (
+                hi == self.viewport.right
+                and hi - x < len(cells)
+                and cells[hi - x] == CONTINUATION
+            ):
+                row[-1] = self.code(" ")
+            self.links[area] = 0
 
     def get_char(self, position: Position, offset: Position = Position(0, 0)) -> str:
-        return self.array[position.y + offset.y][position.x + offset.x]
+        x = position.x + offset.x - self.viewport.x
+        y = position.y + offset.y - self.viewport.y
+        return self.style.char(self.array[y, x])
+
+    def fill_rect(self, x: int, y: int, width: int, height: int, char: str):
+        self._fill(x, y, x + width, y + height, self.code(char))
 
     def draw_line(self, start: Position, end: Position, line_symbol: str):
+        # Draws from start up to, but not including, end
         diff = end - start
-        current = start
-        # print(diff.__dict__)
-        # assert diff.x == 0 ^ diff.y == 0
-        step = diff.norm()
-
-        # print(current.__dict__)
-        # print(end.__dict__)
-        # print((current + step).__dict__)
+        code = self.code(line_symbol)
 
-        while current != end:
-            self.draw_char(line_symbol, current)
-            # print(current.__dict__)
-            current += step
+        if diff.y == 0:
+            if diff.x >= 0:
+                self._fill(start.x, start.y, end.x, start.y + 1, code)
+            else:
+                self._fill(end.x + 1, start.y, start.x + 1, start.y + 1, code)
+        elif diff.x == 0:
+            if diff.y >= 0:
+                self._fill(start.x, start.y, start.x + 1, end.y, code)
+            else:
+                self._fill(start.x, end.y + 1, start.x + 1, start.y + 1, code)
+        else:
+            assert abs(diff.x) == abs(diff.y)
+            step = diff.norm()
+            n = np.arange(abs(diff.x))
+            xs = start.x + step.x * n
+            ys = start.y + step.y * n
+            clip = self.clip
+            inside = (
+                (xs >= clip.x) & (xs < clip.right) & (ys >= clip.y) & (ys < clip.bottom)
+            )
+            cells = (ys[inside] - self.viewport.y, xs[inside] - self.viewport.x)
+            self.array[cells] = code
+            self.links[cells] = 0
 
-        # self.array[position.y + offset.y][position.x + offset.x] = char
+    def connect(self, start: Position, end: Position):
+        """Draw a straight line joining both cells, merging it with any line
+        already crossing or touching it"""
+        if start.y == end.y:
+            if start.x == end.x:
+                return
+            a, b = sorted((start.x, end.x))
+            y = start.y
+            self._link(a, y, a + 1, y + 1, LINK_RIGHT)
+            self._link(a + 1, y, b, y + 1, LINK_LEFT | LINK_RIGHT)
+            self._link(b, y, b + 1, y + 1, LINK_LEFT)
+        else:
+            assert start.x == end.x
+            a, b = sorted((start.y, end.y))
+            x = start.x
+            self._link(x, a, x + 1, a + 1, LINK_DOWN)
+            self._link(x, a + 1, x + 1, b, LINK_UP | LINK_DOWN)
+            self._link(x, b, x + 1, b + 1, LINK_UP)
 
     def draw_char(
         self, char: str, position: Position, offset: Position = Position(0, 0)
     ):
-        self.array[position.y + offset.y][position.x + offset.x] = char
+        x = position.x + offset.x
+        y = position.y + offset.y
+        if self.clip.contains(x, y):
+            cell = (y - self.viewport.y, x - self.viewport.x)
+            self.array[cell] = self.code(char)
+            self.links[cell] = 0
+
+    def draw_glyph(
+        self, glyph: int, position: Position, offset: Position = Position(0, 0)
+    ):
+        x = position.x + offset.x
+        y = position.y + offset.y
+        if self.clip.contains(x, y):
+            cell = (y - self.viewport.y, x - self.viewport.x)
+            self.array[cell] = glyph
+            self.links[cell] = 0
+
+    def sprite(self, box: Box) -> Sprite | None:
+        """Cells of a box looking the same, if one was drawn before and
+        sprites are on"""
+        if self.sprites is None:
+            return None
+        return self.sprites.get(sprite_key(box, self.dtype))
+
+    def keep_sprite(self, box: Box):
+        """Keep the cells the box was just drawn into as its sprite, if it
+        was drawn whole"""
+        if self.sprites is None:
+            return
+        rect = box.bounds()
+        if rect.intersection(self.clip) != rect:
+            return
+        area = self.area(rect.x, rect.y, rect.right, rect.bottom)
+        sprite = (self.array[area].copy(), self.links[area].copy())
+        self.sprites.put(sprite_key(box, self.dtype), sprite)
+
+    def blit(self, sprite: Sprite, position: Position):
+        """Copy a sprite to the canvas, replacing the cells and links below"""
+        cells, links = sprite
+        height, width = cells.shape
+        rect = Rect(position.x, position.y, width, height).intersection(self.clip)
+        if rect.is_empty():
+            return
+        src = (
+            slice(rect.y - position.y, rect.bottom - position.y),
+            slice(rect.x - position.x, rect.right - position.x),
+        )
+        area = self.area(rect.x, rect.y, rect.right, rect.bottom)
+        out = self.array[area]
+        out[...] = cells[src]
+        # Halves of wide characters cut by the viewport are blanked, as in draw
+        blank = self.code(" ")
+        if rect.x == self.viewport.x:
+            first = out[:, 0]
+            first[first == CONTINUATION] = blank
+        if rect.right == self.viewport.right and src[1].stop < width:
+            out[:, -1][cells[src[0], src[1].stop] == CONTINUATION] = blank
+        self.links[area] = links[src]
+
+    def _fill(self, x0: int, y0: int, x1: int, y1: int, code: int):
+        # Fill the half-open cell range [x0, x1) x [y0, y1), clipped
+        clip = self.clip
+        x0 = max(x0, clip.x)
+        y0 = max(y0, clip.y)
+        x1 = min(x1, clip.right)
+        y1 = min(y1, clip.bottom)
+        if x0 < x1 and y0 < y1:
+            area = self.area(x0, y0, x1, y1)
+            self.array[area] = code
+            self.links[area] = 0
+
+    def _link(self, x0: int, y0: int, x1: int, y1: int, bits: int):
+        # Add link bits to the half-open cell range, clipped
+        clip = self.clip
+        x0 = max(x0, clip.x)
+        y0 = max(y0, clip.y)
+        x1 = min(x1, clip.right)
+        y1 = min(y1, clip.bottom)
+        if x0 < x1 and y0 < y1:
+            self.links[self.area(x0, y0, x1, y1)] |= bits
+
+    def area(self, x0: int, y0: int, x1: int, y1: int):
+        # Array slices of the half-open canvas range, which must lie within
+        # the viewport
+        x, y = self.viewport.x, self.viewport.y
+        return slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)
+
+    def frame(self, style: Style | None = None) -> np.ndarray:
+        """Code points of the cells, with glyphs drawn in the style"""
+        return (style or self.style).apply(self.array)
+
+    def to_string(self, style: Style | None = None):
+        return rows_text(self.array, style or self.style)
+
+    def write(self, stream: BinaryIO, style: Style | None = None) -> int:
+        """Write the canvas to a binary stream as UTF-8 text, the same as
+        to_string, returning the number of bytes written.
+
+        Rows are encoded a block at a time, so memory use stays bounded
+        however large the canvas is.
+        """
+        written = 0
+        for block in self.encode(style):
+            stream.write(block)
+            written += len(block)
+        return written
+
+    def write_into(self, buffer, style: Style | None = None) -> int:
+        """Encode the canvas into a writable buffer, returning the number of
+        bytes used. Raises ValueError if it does not fit."""
+        view = memoryview(buffer).cast("B")
+        written = 0
+        for block in self.encode(style):
+            end = written + len(block)
+            if end > len(view):
+                raise ValueError(f"buffer of {len(view)} bytes is too small")
+            view[written:end] = block
+            written = end
+        return written
+
+    def encode(self, style: Style | None = None) -> Iterator[bytes]:
+        """UTF-8 text of the canvas in blocks of whole rows"""
+        style = style or self.style
+        rows = max(1, BLOCK_CELLS // (self.viewport.width + 1))
+        for y in range(0, self.viewport.height, rows):
+            yield rows_text(self.array[y : y + rows], style).encode()
+
+
+# Cell types that hold U+FFFD, and so every code point or its replacement
+CELL_DTYPES = (np.dtype(np.uint16), np.dtype(np.uint32))
+
+# Cells encoded, or resolved, at once by Canvas.encode and resolve_links
+BLOCK_CELLS = 1 << 18
+
+# Stored for characters that do not fit the cell dtype
+REPLACEMENT = 0xFFFD
+
+# Changed areas are redrawn in whole tiles of this many cells
+TILE_WIDTH = 16
+TILE_HEIGHT = 4
+
+# Past this many areas to redraw, or this fraction of the viewport, a render
+# redraws everything at once instead
+FULL_RENDER_RECTS = 128
+FULL_RENDER_AREA = 0.5
+
+
+def sprite_key(box: Box, dtype: np.dtype):
+    # Everything the cells of a box depend on
+    return (box.width, box.height, box.text, dtype.str)
+
+
+def rows_text(cells: np.ndarray, style: Style) -> str:
+    """Rows of cells as lines of text"""
+    height, width = cells.shape
+    lines = np.empty((height, width + 1), dtype="<u4")
+    lines[:, width] = ord("\n")
+    lines[:, :width] = style.apply(cells)
+
+    halves = wide_halves(cells)
+    if halves is None:
+        return lines.tobytes().decode("utf-32-le")
+
+    blank, skip = halves
+    lines[:, :width][blank] = ord(" ")
+    keep = np.ones(lines.shape, dtype=bool)
+    keep[:, :width] = ~skip
+    return lines[keep].tobytes().decode("utf-32-le")
+
+
+def to_codepoints(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+
+
+def merge_rects(rects: List[Rect], bounds: Rect) -> List[Rect]:
+    """Cover the rectangles with tiles of the bounds, joined into runs along
+    each row of tiles, so that no area is redrawn twice. Takes time linear in
+    the rectangles and tiles, however many rectangles overlap."""
+    if not rects:
+        return []
+    rows = -(-bounds.height // TILE_HEIGHT)
+    cols = -(-bounds.width // TILE_WIDTH)
+    x0, y0, x1, y1 = np.array(
+        [(r.x, r.y, r.x + r.width - 1, r.y + r.height - 1) for r in rects]
+    ).T
+    x0, x1 = (x0 - bounds.x) // TILE_WIDTH, (x1 - bounds.x) // TILE_WIDTH + 1
+    y0, y1 = (y0 - bounds.y) // TILE_HEIGHT, (y1 - bounds.y) // TILE_HEIGHT + 1
+
+    # Count the rectangles over every tile from the corners of each
+    corners = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+    np.add.at(corners, (y0, x0), 1)
+    np.add.at(corners, (y0, x1), -1)
+    np.add.at(corners, (y1, x0), -1)
+    np.add.at(corners, (y1, x1), 1)
+    dirty = np.cumsum(np.cumsum(corners, axis=0), axis=1)[:rows, :cols] > 0
 
-    def to_string(self):
-        return "".join([item for row in self.array for item in row])
+    edges = np.diff(dirty.astype(np.int8), axis=1, prepend=0, append=0)
+    row, first = np.nonzero(edges == 1)
+    last = np.nonzero(edges == -1)[1]
+    return [
+        Rect(
+            bounds.x + a * TILE_WIDTH,
+            bounds.y + y * TILE_HEIGHT,
+            (b - a) * TILE_WIDTH,
+            TILE_HEIGHT,
+        ).intersection(bounds)
+        for y, a, b in zip(row.tolist(), first.tolist(), last.tolist())
+    ]
@@ -0,0 +1,123 @@
+"""Draw Graphviz DOT files as text.
+
+pytermgraph diagrams/ -o out/ --jobs 8
+pytermgraph a.dot b.dot --style ascii
+"""
+
+# Only the standard library is imported up front, so that the command starts
+# quickly. NumPy and Graphviz are loaded once per worker process.
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+DOT_SUFFIXES = (".dot", ".gv")
+STYLE_NAMES = ("light", "heavy", "double", "rounded", "ascii")
+
+# Files per task sent to a worker
+CHUNK_SIZE = 4
+
+
+def find_inputs(paths: List[str]) -> List[Tuple[str, str]]:
+    """Files given directly, and the DOT files under given directories, each
+    with its name relative to the directory it was found in"""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append((path, os.path.basename(path)))
+            continue
+        found = []
+        for root, _, names in os.walk(path):
+            found += [os.path.join(root, n) for n in names if n.endswith(DOT_SUFFIXES)]
+        files += [(f, os.path.relpath(f, path)) for f in sorted(found)]
+    return files
+
+
+def init_worker():
+    # Pay for the heavy imports once per process rather than once per file
+    from . import builder  # noqa: F401
+
+
+def render_file(path: str, style: str) -> Tuple[str, str | None, str | None]:
+    """The drawing of one file, or the error that prevented it"""
+    from .builder import render_dot
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            return path, render_dot(f.read(), style), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def output_path(name: str, output_dir: str) -> str:
+    """Where the drawing of an input goes, mirroring the input directories"""
+    return os.path.join(output_dir, os.path.splitext(name)[0] + ".txt")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="pytermgraph", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("paths", nargs="+", help="DOT files, or directories of them")
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="write NAME.txt here for every NAME.dot, in the same subdirectories",
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes to use")
+    parser.add_argument("--style", default="light", choices=STYLE_NAMES)
+    args = parser.parse_args(argv)
+
+    inputs = find_inputs(args.paths)
+    if not inputs:
+        parser.error("no DOT files found")
+    files = [path for path, _ in inputs]
+    jobs = min(args.jobs or os.cpu_count() or 1, len(files))
+
+    # Where each input is written. Inputs with the same name given
+    # separately would overwrite each other, so they are refused.
+    targets: Dict[str, str] = {}
+    if args.output_dir is not None:
+        sources: Dict[str, str] = {}
+        for path, name in inputs:
+            out = output_path(name, args.output_dir)
+            if sources.setdefault(out, path) != path:
+                parser.error(
+                    f"{sources[out]} and {path} would both be written to {out}"
+                )
+            targets[path] = out
+
+    if jobs == 1:
+        init_worker()
+        results = (render_file(path, args.style) for path in files)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker)
+        results = pool.map(
+            render_file, files, [args.style] * len(files), chunksize=CHUNK_SIZE
+        )
+
+    failed = 0
+    try:
+        for path, text, error in results:
+            if error is not None:
+                failed += 1
+                print(f"pytermgraph: {path}: {error}", file=sys.stderr)
+            elif args.output_dir is not None:
+                out = targets[path]
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                with open(out, "w", encoding="utf-8") as f:
+                    f.write(text)
+            else:
+                if len(files) > 1:
+                    print(f"==> {path} <==")
+                sys.stdout.write(text)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,413 @@
+from bisect import bisect_left, insort
+from typing import Dict, Hashable, Iterable, List, Mapping, Tuple
+
+import numpy as np
+
+from .cache import LayoutCache, layout_key
 from .canvas import Canvas
+from .layout import H_GAP, V_GAP, layered_layout
+from .object import Box, Edge
+from .support import Direction, Position, PositionArray, Routing
+from .text import text_width
+
+# Fraction of edges that may point upwards beyond those of the last full
+# layout, before update() lays the graph out again
+RELAYOUT_THRESHOLD = 0.1
+
+# Room around the label: border and one space on each side
+LABEL_PADDING = 4
+BOX_HEIGHT = 3
 
 
 class Graph:
-    def __init__(self, canvas: Canvas) -> None:
+    def __init__(
+        self,
+        canvas: Canvas | None = None,
+        cache: LayoutCache | None = None,
+        relayout_threshold: float = RELAYOUT_THRESHOLD,
+    ) -> None:
         self.canvas = canvas
+        # Whether the canvas was created, and is resized, by the graph
+        self.fit_canvas = canvas is None
+        # Reuse layouts of graphs with the same shape and node sizes
+        self.cache = cache
+        # Drift past which update() lays everything out again
+        self.relayout_threshold = relayout_threshold
+
+        # Nodes are numbered in insertion order
+        self.nodes: Dict[Hashable, int] = {}
+        self.names: List[Hashable] = []
+        self.labels: List[str] = []
+        self.sources: List[int] = []
+        self.targets: List[int] = []
+        # Ends of the other edges of each node, by name, one per edge
+        self.predecessors: Dict[Hashable, List[Hashable]] = {}
+        self.successors: Dict[Hashable, List[Hashable]] = {}
+
+        self.boxes: Dict[Hashable, Box] = {}
+        # Drawn edge of each edge, or None for loops. Edges and nodes past
+        # the end of edges and layer were added since the last drawing.
+        self.edges: List[Edge | None] = []
+        self.layer: List[int] = []
+        # Routing of the drawn edges, kept by update()
+        self.routing = Routing.MANHATTAN
+        # Edges drawn against the flow of the layers by the last full layout,
+        # and now
+        self.upward = 0
+        self.upward_now = 0
+        # Left and right of the boxes of every drawn layer, sorted, and its top
+        self.rows: Dict[int, List[Tuple[int, int]]] = {}
+        self.tops: Dict[int, int] = {}
+
+    def add_node(self, name: Hashable, label: str | None = None) -> int:
+        if name in self.nodes:
+            return self.nodes[name]
+        self.nodes[name] = len(self.names)
+        self.names.append(name)
+        self.labels.append(str(name) if label is None else label)
+        self.predecessors[name] = []
+        self.successors[name] = []
+        return self.nodes[name]
+
+    def add_edge(self, tail: Hashable, head: Hashable):
+        self.sources.append(self.add_node(tail))
+        self.targets.append(self.add_node(head))
+        self.connect(tail, head)
+
+    def connect(self, tail: Hashable, head: Hashable):
+        if tail != head:
+            self.successors[tail].append(head)
+            self.predecessors[head].append(tail)
+
+    def remove_node(self, name: Hashable):
+        """Remove a node and its edges, and their drawing if there is one"""
+        i = self.nodes.pop(name)
+        del self.names[i]
+        del self.labels[i]
+
+        for other in self.predecessors.pop(name):
+            self.successors[other] = [n for n in self.successors[other] if n != name]
+        for other in self.successors.pop(name):
+            self.predecessors[other] = [
+                n for n in self.predecessors[other] if n != name
+            ]
+
+        keep = [s != i and t != i for s, t in zip(self.sources, self.targets)]
+        drawn = len(self.edges)
+        for j, kept in enumerate(keep[:drawn]):
+            if not kept and self.edges[j] is not None:
+                self.canvas.remove(self.edges[j])
+                self.upward_now -= (
+                    self.layer[self.sources[j]] >= self.layer[self.targets[j]]
+                )
+        self.edges = [e for e, kept in zip(self.edges, keep) if kept]
+
+        # Renumber the nodes after it
+        self.sources = [s - (s > i) for s, kept in zip(self.sources, keep) if kept]
+        self.targets = [t - (t > i) for t, kept in zip(self.targets, keep) if kept]
+        for other in self.names[i:]:
+            self.nodes[other] -= 1
+
+        box = self.boxes.pop(name, None)
+        if box is not None:
+            lyr = self.layer.pop(i)
+            row = self.rows[lyr]
+            del row[bisect_left(row, (box.position.x,))]
+            if not row:
+                del self.rows[lyr]
+                del self.tops[lyr]
+            self.canvas.remove(box, keep_routes=True)
+
+    def add_nodes(self, names: Iterable[Hashable], labels: Iterable[str] | None = None):
+        if labels is None:
+            for name in names:
+                self.add_node(name)
+        else:
+            for name, label in zip(names, labels):
+                self.add_node(name, label)
+
+    def add_edges(self, tails: Iterable[Hashable], heads: Iterable[Hashable]):
+        """Add many edges at once, adding missing nodes.
+
+        NumPy arrays of numbers or strings are handled in bulk: each distinct
+        name is looked up once, and edges are numbered with NumPy.
+        """
+        bulk = isinstance(tails, np.ndarray) and isinstance(heads, np.ndarray)
+        if not bulk or tails.dtype == object or heads.dtype == object:
+            for tail, head in zip(tails, heads):
+                self.add_edge(tail, head)
+            return
+        if tails.shape != heads.shape or tails.ndim != 1:
+            raise ValueError("tails and heads must be flat and of the same length")
+
+        # Nodes are added in order of first appearance, as add_edge would
+        ends = np.stack([tails, heads], axis=1).ravel()
+        names, first, inverse = np.unique(ends, return_index=True, return_inverse=True)
+        ids = np.empty(len(names), dtype=np.int64)
+        for i in np.argsort(first, kind="stable").tolist():
+            ids[i] = self.add_node(names[i].item())
+        ends = ids[inverse.ravel()]
+        sources, targets = ends[0::2].tolist(), ends[1::2].tolist()
+        self.sources.extend(sources)
+        self.targets.extend(targets)
+        for s, t in zip(sources, targets):
+            self.connect(self.names[s], self.names[t])
+
+    @classmethod
+    def from_edges(
+        cls,
+        tails: Iterable[Hashable],
+        heads: Iterable[Hashable],
+        nodes: Iterable[Hashable] | None = None,
+        labels: Iterable[str] | None = None,
+        **kwargs,
+    ) -> "Graph":
+        """Graph of an edge list. Nodes listed in nodes come first, in order,
+        with their labels, and may have no edges."""
+        graph = cls(**kwargs)
+        if nodes is not None:
+            graph.add_nodes(nodes, labels)
+        graph.add_edges(tails, heads)
+        return graph
+
+    @classmethod
+    def from_adjacency(
+        cls, adjacency: Mapping[Hashable, Iterable[Hashable]], **kwargs
+    ) -> "Graph":
+        """Graph of a mapping from each node to its successors, such as a dict
+        of lists, or the adj of a networkx DiGraph"""
+        graph = cls(**kwargs)
+        graph.add_nodes(adjacency)
+        for tail, successors in adjacency.items():
+            for head in successors:
+                graph.add_edge(tail, head)
+        return graph
+
+    def node_sizes(self, first: int = 0):
+        """Widths and heights of the boxes of the nodes from first on"""
+        labels = self.labels[first:]
+        widths = np.array([text_width(label) for label in labels], dtype=np.int64)
+        widths += LABEL_PADDING
+        heights = np.full(len(labels), BOX_HEIGHT, dtype=np.int64)
+        return widths, heights
+
+    def layout(self):
+        """Compute the top-left corner of every node, as (x, y) arrays, and
+        the points every edge bends at, as offsets and an array of points"""
+        widths, heights = self.node_sizes()
+        n = len(self.names)
+
+        if self.cache is None:
+            layout = layered_layout(n, self.sources, self.targets, widths, heights)
+        else:
+            key = layout_key(n, self.sources, self.targets, widths, heights)
+            layout = self.cache.get(key)
+            if layout is None:
+                layout = layered_layout(n, self.sources, self.targets, widths, heights)
+                self.cache.put(key, layout)
+
+        x, y, layer, self.reversed, bend_offsets, bends = layout
+        self.layer = layer.tolist()
+        return x, y, bend_offsets, bends
+
+    def draw(self, fill=" ", routing: Routing = Routing.MANHATTAN) -> Canvas:
+        """Lay the graph out and add it to the canvas, creating one that fits
+        if the graph has none yet. Anything drawn before is replaced.
+
+        Edges turn in the rows the layout leaves between layers, and cross
+        layers where the layout kept room for them. Obstacle routing keeps
+        them clear of boxes, but is much slower on large graphs.
+        """
+        self.routing = routing
+        x, y, bend_offsets, bends = self.layout()
+        widths, heights = self.node_sizes()
+        width = int((x + widths).max()) if len(x) else 0
+        if len(bends):
+            width = max(width, int(bends[:, 0].max()) + 1)
+        height = int((y + heights).max()) if len(y) else 0
+
+        if self.canvas is None:
+            self.canvas = Canvas(width, height, fill, routing=routing)
+        elif self.boxes or self.edges:
+            self.canvas.clear()
+            self.boxes.clear()
+            if self.fit_canvas:
+                self.canvas.resize(width, height)
+
+        positions = PositionArray(x, y)
+        boxes = self.canvas.add_boxes(
+            widths.tolist(), heights.tolist(), positions, self.labels
+        )
+        self.boxes.update(zip(self.names, boxes))
+        self.rows.clear()
+        self.tops.clear()
+        for left, right, top, lyr in zip(
+            x.tolist(), (x + widths).tolist(), y.tolist(), self.layer
+        ):
+            self.rows.setdefault(lyr, []).append((left, right))
+            self.tops.setdefault(lyr, top)
+        for row in self.rows.values():
+            row.sort()
+
+        sources = np.asarray(self.sources, dtype=np.int64)
+        targets = np.asarray(self.targets, dtype=np.int64)
+        keep = sources != targets
+        # Reversed edges point up, against the flow of the layers
+        reversed = self.reversed[keep].tolist()
+        points = [Position(x, y) for x, y in bends.tolist()]
+        offsets = bend_offsets.tolist()
+        edges = self.canvas.draw_edges_between(
+            [boxes[i] for i in sources[keep].tolist()],
+            [boxes[i] for i in targets[keep].tolist()],
+            [Direction.UP if r else Direction.DOWN for r in reversed],
+            [Direction.DOWN if r else Direction.UP for r in reversed],
+            start_direction=Direction.VERTICAL,
+            end_direction=Direction.VERTICAL,
+            routing=self.routing,
+            bends=[
+                points[offsets[i] : offsets[i + 1]]
+                for i in np.flatnonzero(keep).tolist()
+            ],
+        )
+        self.edges = [None] * len(self.sources)
+        for i, edge in zip(np.flatnonzero(keep).tolist(), edges):
+            self.edges[i] = edge
+        self.upward = self.upward_now = self.count_upward()
+
+        return self.canvas
+
+    def count_upward(self) -> int:
+        """Edges drawn from a layer to the same or an earlier one"""
+        layer = self.layer
+        return sum(
+            layer[s] >= layer[t]
+            for s, t, e in zip(self.sources, self.targets, self.edges)
+            if e is not None
+        )
+
+    def drift(self) -> float:
+        """How much worse the drawing got through updates since the last full
+        layout, as the fraction of edges that newly point upwards"""
+        return (self.upward_now - self.upward) / max(len(self.edges), 1)
+
+    def update(self) -> Canvas:
+        """Draw the nodes and edges added since the last drawing.
+
+        Boxes already on the canvas stay where they are. New nodes are put in
+        the layer below their predecessors, as close to their neighbours as
+        the row allows. Only the edges of the new nodes, and old edges that
+        now cross a new box, are routed. Once drift() exceeds the relayout
+        threshold, the whole graph is laid out again instead.
+        """
+        if self.canvas is None or not (self.boxes or self.edges):
+            return self.draw(routing=self.routing)
+
+        new_nodes = range(len(self.layer), len(self.names))
+        new_edges = range(len(self.edges), len(self.sources))
+        if not new_nodes and not new_edges:
+            return self.canvas
+
+        widths, heights = self.node_sizes(new_nodes.start)
+        placed: List[Position] = []
+        for i, width in zip(new_nodes, widths.tolist()):
+            self.layer.append(self.pick_layer(i))
+            x = self.place_node(i, width)
+            placed.append(Position(x, row_top(self.tops, self.layer[i])))
+
+        if self.fit_canvas and placed:
+            right = max(p.x + w for p, w in zip(placed, widths.tolist()))
+            bottom = max(p.y + h for p, h in zip(placed, heights.tolist()))
+            self.canvas.resize(
+                max(self.canvas.width, right), max(self.canvas.height, bottom)
+            )
+
+        boxes = self.canvas.add_boxes(
+            widths.tolist(),
+            heights.tolist(),
+            placed,
+            self.labels[new_nodes.start :],
+        )
+        self.boxes.update(zip(self.names[new_nodes.start :], boxes))
+
+        edges = [i for i in new_edges if self.sources[i] != self.targets[i]]
+        upward = [
+            self.layer[self.sources[i]] >= self.layer[self.targets[i]] for i in edges
+        ]
+        drawn = self.canvas.draw_edges_between(
+            [self.boxes[self.names[self.sources[i]]] for i in edges],
+            [self.boxes[self.names[self.targets[i]]] for i in edges],
+            [Direction.UP if u else Direction.DOWN for u in upward],
+            [Direction.DOWN if u else Direction.UP for u in upward],
+            start_direction=Direction.VERTICAL,
+            end_direction=Direction.VERTICAL,
+            routing=self.routing,
+        )
+        self.edges.extend([None] * len(new_edges))
+        for i, edge in zip(edges, drawn):
+            self.edges[i] = edge
+        self.upward_now += sum(upward)
+
+        if self.drift() > self.relayout_threshold:
+            return self.draw(routing=self.routing)
+        return self.canvas
+
+    def pick_layer(self, i: int) -> int:
+        """Layer of a new node: below its drawn predecessors, or else above its
+        drawn successors"""
+        layer = self.layer
+        drawn = len(layer)
+        name = self.names[i]
+        above = [self.nodes[n] for n in self.predecessors[name]]
+        above = [layer[j] for j in above if j < drawn]
+        if above:
+            return max(above) + 1
+        below = [self.nodes[n] for n in self.successors[name]]
+        below = [layer[j] for j in below if j < drawn]
+        if below:
+            return max(min(below) - 1, 0)
+        return 0
+
+    def place_node(self, i: int, width: int) -> int:
+        """Left of a new node within the row of its layer"""
+        name = self.names[i]
+        row = self.rows.setdefault(self.layer[i], [])
+
+        # Centre under the neighbours already drawn, or else at the end of the row
+        centers = []
+        for other in self.predecessors[name] + self.successors[name]:
+            box = self.boxes.get(other)
+            if box is not None:
+                centers.append(box.position.x + box.width // 2)
+        if centers:
+            desired = max(sum(centers) // len(centers) - width // 2, 0)
+        else:
+            desired = row[-1][1] + H_GAP if row else 0
+
+        # Nearest free spot of the row, keeping the gap to other boxes. Gap k
+        # lies between boxes k - 1 and k, and only the nearest gap wide enough
+        # on either side of the desired spot is looked at.
+        def spot(k):
+            low = row[k - 1][1] + H_GAP if k > 0 else 0
+            high = row[k][0] - H_GAP - width if k < len(row) else max(desired, low)
+            return min(max(desired, low), high) if low <= high else None
+
+        k = bisect_left(row, (desired,))
+        spots = []
+        # Ties go to the right
+        for gaps in (range(k + 1, len(row) + 1), range(k, -1, -1)):
+            found = next((x for x in map(spot, gaps) if x is not None), None)
+            if found is not None:
+                spots.append(found)
+        x = min(spots, key=lambda x: abs(x - desired))
+        insort(row, (x, x + width))
+        return x
+
+
+def row_top(tops: Dict[int, int], lyr: int) -> int:
+    if lyr in tops:
+        return tops[lyr]
+    # New rows are spaced like the layout spaces them
+    last = max((k for k in tops if k < lyr), default=None)
+    top = 0 if last is None else tops[last] + (lyr - last) * (BOX_HEIGHT + V_GAP)
+    tops[lyr] = top
+    return top
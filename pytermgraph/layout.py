@@ -0,0 +1,351 @@
+from typing import Tuple
+
+import numpy as np
+
+# Empty columns between neighbouring nodes of a layer
+H_GAP = 2
+# Empty rows between layers, where edges turn
+V_GAP = 3
+# Number of down and up barycenter passes
+SWEEPS = 4
+# Number of passes pulling nodes towards their neighbours
+ALIGN_PASSES = 4
+
+
+def csr(keys: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Edge indices grouped by key, and the offset of each group"""
+    order = np.argsort(keys, kind="stable")
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=offsets[1:])
+    return order, offsets
+
+
+def ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """The ranges [start, start + count), end to end"""
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # Concatenate the ranges without a Python loop
+    shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shift + np.arange(total)
+
+
+def gather(order: np.ndarray, offsets: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Indices of all edges in the groups of the given nodes"""
+    starts = offsets[nodes]
+    return order[ranges(starts, offsets[nodes + 1] - starts)]
+
+
+def break_cycles(n: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Mask of edges to reverse so that the graph has no cycles.
+
+    These are the back edges of a depth-first search, run without recursion
+    so that long chains don't hit the interpreter's stack limit.
+    """
+    order, offsets = csr(sources, n)
+    heads = targets[order].tolist()
+    edge_ids = order.tolist()
+    offsets = offsets.tolist()
+
+    # 0: not visited, 1: on the stack, 2: done
+    state = [0] * n
+    reversed = np.zeros(len(sources), dtype=bool)
+    back = []
+    for root in range(n):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, offsets[root])]
+        while stack:
+            node, i = stack[-1]
+            if i == offsets[node + 1]:
+                state[node] = 2
+                stack.pop()
+                continue
+            stack[-1] = (node, i + 1)
+            head = heads[i]
+            if state[head] == 0:
+                state[head] = 1
+                stack.append((head, offsets[head]))
+            elif state[head] == 1:
+                back.append(edge_ids[i])
+    reversed[back] = True
+    return reversed
+
+
+def assign_layers(n: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Longest-path layering of an acyclic graph.
+
+    Nodes are peeled off in topological order, one whole layer of sources
+    at a time.
+    """
+    out_order, out_offsets = csr(sources, n)
+    indegree = np.bincount(targets, minlength=n)
+    layer = np.zeros(n, dtype=np.int64)
+
+    frontier = np.flatnonzero(indegree == 0)
+    level = 0
+    while len(frontier):
+        layer[frontier] = level
+        level += 1
+
+        heads = targets[gather(out_order, out_offsets, frontier)]
+        indegree -= np.bincount(heads, minlength=n)
+        heads = np.unique(heads)
+        frontier = heads[indegree[heads] == 0]
+
+    return layer
+
+
+def split_long_edges(
+    layer: np.ndarray, sources: np.ndarray, targets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Insert one dummy node per crossed layer, so every edge joins adjacent
+    layers. Returns the layers of all nodes, dummies last, and the edges."""
+    n = len(layer)
+    span = layer[targets] - layer[sources]
+    count = int(span.sum())
+
+    # Position of each piece within its edge
+    edge = np.repeat(np.arange(len(sources)), span)
+    step = np.arange(count) - np.repeat(np.cumsum(span) - span, span)
+    # Dummies are numbered by piece, skipping the last piece of every edge
+    last = step == span[edge] - 1
+    dummy = n + np.cumsum(~last) - 1
+
+    src = np.where(step == 0, sources[edge], np.roll(dummy, 1))
+    dst = np.where(last, targets[edge], dummy)
+    dummy_layer = (layer[sources[edge]] + step + 1)[~last]
+    return np.concatenate([layer, dummy_layer]), src, dst
+
+
+def order_layers(
+    layer: np.ndarray, sources: np.ndarray, targets: np.ndarray
+) -> np.ndarray:
+    """Rank of every node within its layer, from barycenter sweeps.
+
+    Expects nodes numbered layer by layer, and edges from each layer to the
+    next one.
+    """
+    n = len(layer)
+    depth = int(layer.max()) + 1 if n else 0
+    starts = np.searchsorted(layer, np.arange(depth + 1))
+    rank = np.arange(n) - starts[layer]
+
+    down = np.argsort(layer[targets], kind="stable")
+    down_starts = np.searchsorted(layer[targets][down], np.arange(depth + 1))
+    up = np.argsort(layer[sources], kind="stable")
+    up_starts = np.searchsorted(layer[sources][up], np.arange(depth + 1))
+
+    def reorder(lyr, edges, near, far):
+        lo, hi = starts[lyr], starts[lyr + 1]
+        local = near[edges] - lo
+        weight = np.bincount(local, weights=rank[far[edges]], minlength=hi - lo)
+        count = np.bincount(local, minlength=hi - lo)
+        current = rank[lo:hi]
+        # Nodes without neighbours on that side keep their place
+        barycenter = np.where(
+            count > 0, weight / np.maximum(count, 1), current.astype(np.float64)
+        )
+        order = np.lexsort((current, barycenter))
+        rank[lo + order] = np.arange(hi - lo)
+
+    for _ in range(SWEEPS):
+        for lyr in range(1, depth):
+            reorder(
+                lyr, down[down_starts[lyr] : down_starts[lyr + 1]], targets, sources
+            )
+        for lyr in range(depth - 2, -1, -1):
+            reorder(lyr, up[up_starts[lyr] : up_starts[lyr + 1]], sources, targets)
+
+    return rank
+
+
+def place(
+    layer: np.ndarray,
+    rank: np.ndarray,
+    widths: np.ndarray,
+    heights: np.ndarray,
+    sources: np.ndarray,
+    targets: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-left corner of every node, keeping the order within layers"""
+    n = len(layer)
+    depth = int(layer.max()) + 1 if n else 0
+
+    # Nodes sorted by layer, then rank
+    order = np.lexsort((rank, layer))
+    starts = np.searchsorted(layer[order], np.arange(depth + 1))
+
+    # Rows: each layer is as tall as its tallest node
+    layer_height = np.zeros(depth, dtype=np.int64)
+    np.maximum.at(layer_height, layer, heights)
+    layer_y = np.concatenate([[0], np.cumsum(layer_height + V_GAP)[:-1]])
+    y = layer_y[layer]
+
+    # Columns: start packed to the left, then pull every node towards the
+    # centers of its neighbours without letting nodes of a layer overlap
+    x = np.zeros(n, dtype=np.float64)
+    for lyr in range(depth):
+        nodes = order[starts[lyr] : starts[lyr + 1]]
+        x[nodes] = np.concatenate([[0], np.cumsum(widths[nodes] + H_GAP)[:-1]])
+
+    for p in range(ALIGN_PASSES):
+        center = x + widths / 2
+        if p % 2 == 0:
+            near, far = targets, sources
+        else:
+            near, far = sources, targets
+        pull = np.bincount(near, weights=center[far], minlength=n)
+        count = np.bincount(near, minlength=n)
+        desired = np.where(count > 0, pull / np.maximum(count, 1) - widths / 2, x)
+
+        for lyr in range(depth):
+            nodes = order[starts[lyr] : starts[lyr + 1]]
+            x[nodes] = separate(desired[nodes], widths[nodes])
+
+    x = np.round(x).astype(np.int64)
+    x -= x.min() if n else 0
+    return x, y
+
+
+def straighten(
+    layer: np.ndarray,
+    x: np.ndarray,
+    widths: np.ndarray,
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+):
+    """Move dummies in place right below the dummy above them wherever that
+    column is free, so that long edges run straight instead of jogging at
+    every layer"""
+    if len(layer) == n:
+        return
+    depth = int(layer.max()) + 1
+    above = np.full(len(layer), -1, dtype=np.int64)
+    above[targets] = sources
+    # Nodes keep a free cell on either side, dummies only need their own
+    margin = (np.arange(len(layer)) < n).astype(np.int64)
+
+    order = np.argsort(layer, kind="stable")
+    starts = np.searchsorted(layer[order], np.arange(depth + 1))
+    for lyr in range(1, depth):
+        nodes = order[starts[lyr] : starts[lyr + 1]]
+        movers = nodes[(nodes >= n) & (above[nodes] >= n)]
+        if not len(movers):
+            continue
+        wanted = x[above[movers]]
+        nodes = nodes[np.argsort(x[nodes], kind="stable")]
+        lefts = x[nodes] - margin[nodes]
+        rights = x[nodes] + widths[nodes] - 1 + margin[nodes]
+        # The node starting last at or before the wanted column is the only
+        # one that may cover it
+        hit = np.searchsorted(lefts, wanted, side="right") - 1
+        blocked = (hit >= 0) & (rights[np.maximum(hit, 0)] >= wanted)
+        blocked &= nodes[np.maximum(hit, 0)] != movers
+        x[movers[~blocked]] = wanted[~blocked]
+
+
+def separate(desired: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """Positions closest to the desired ones that keep nodes apart, in order"""
+    # x[i] >= x[i - 1] + widths[i - 1] + H_GAP. Subtracting the packed offsets
+    # turns that into a running maximum, and a running minimum from the right.
+    packed = np.concatenate([[0], np.cumsum(widths + H_GAP)[:-1]])
+    left = np.maximum.accumulate(desired - packed) + packed
+    right = np.minimum.accumulate((desired - packed)[::-1])[::-1] + packed
+    middle = (left + right) / 2
+    return np.maximum.accumulate(middle - packed) + packed
+
+
+def layered_layout(
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    widths: np.ndarray,
+    heights: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Sugiyama-style layout of a directed graph, top to bottom.
+
+    Returns the x and y of every node's top-left corner, the layer of every
+    node and the mask of edges that had to be reversed to break cycles,
+    then the offsets of every edge's bends and the (x, y) bends. An edge
+    crossing layers runs along a column of each from one bend to the next,
+    and its bends are listed from its source to its target.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+
+    loops = sources == targets
+    s, t = sources[~loops], targets[~loops]
+    reversed = break_cycles(n, s, t)
+    s, t = np.where(reversed, t, s), np.where(reversed, s, t)
+    layer = assign_layers(n, s, t)
+
+    full_layer, src, dst = split_long_edges(layer, s, t)
+    dummies = len(full_layer) - n
+
+    # Renumber layer by layer, as order_layers expects
+    perm = np.argsort(full_layer, kind="stable")
+    new_id = np.empty_like(perm)
+    new_id[perm] = np.arange(len(perm))
+    rank = np.empty_like(perm)
+    rank[perm] = order_layers(full_layer[perm], new_id[src], new_id[dst])
+
+    all_widths = np.concatenate([widths, np.ones(dummies, dtype=np.int64)])
+    all_heights = np.concatenate([heights, np.ones(dummies, dtype=np.int64)])
+    x, y = place(full_layer, rank, all_widths, all_heights, src, dst)
+    straighten(full_layer, x, all_widths, n, src, dst)
+
+    edge_reversed = np.zeros(len(sources), dtype=bool)
+    edge_reversed[~loops] = reversed
+    # Layers crossed by every edge, whose dummies are numbered edge by edge
+    # from the upper end down
+    crossed = np.zeros(len(sources), dtype=np.int64)
+    crossed[~loops] = layer[t] - layer[s] - 1
+    bend_offsets, bends = dummy_bends(full_layer, x, y, n, crossed, edge_reversed)
+    return x[:n], y[:n], layer, edge_reversed, bend_offsets, bends
+
+
+def dummy_bends(
+    layer: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    n: int,
+    crossed: np.ndarray,
+    reversed: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top and bottom of the column of every dummy node, per edge, as
+    offsets into the bends of all edges and the bends"""
+    # A dummy's column runs from the top of its layer to the row above the
+    # gap before the next one
+    tops = np.zeros(int(layer.max()) + 2 if len(layer) else 1, dtype=np.int64)
+    tops[layer] = y
+    dummy = np.arange(n, len(layer))
+    bottom = tops[layer[dummy] + 1] - V_GAP - 1
+    points = np.stack(
+        [np.repeat(x[dummy], 2), np.stack([y[dummy], bottom], axis=1).ravel()], axis=1
+    )
+
+    # Where an edge goes straight on from one dummy to the next, the bends
+    # between them are dropped
+    edge = np.repeat(np.arange(len(crossed)), crossed)
+    straight = np.zeros(len(dummy), dtype=bool)
+    straight[1:] = (edge[1:] == edge[:-1]) & (x[dummy[1:]] == x[dummy[:-1]])
+    keep = np.ones(len(points), dtype=bool)
+    keep[0::2] = ~straight
+    keep[1:-1:2] &= ~straight[1:]
+    points = points[keep]
+    edge = np.repeat(edge, 2)[keep]
+    offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(edge, minlength=len(crossed)))]
+    )
+
+    # Reversed edges are drawn from the lower end up
+    index = np.arange(len(points))
+    index = np.where(
+        reversed[edge], offsets[edge] + offsets[edge + 1] - 1 - index, index
+    )
+    return offsets, points[index]
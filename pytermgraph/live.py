@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Any, Callable
+
+from .canvas import Canvas
+from .terminal import FrameWriter
+
+
+class LiveCanvas:
+    """Renders a canvas continuously while other tasks change it.
+
+    Producers submit changes as callables instead of touching the canvas
+    directly. The render task applies everything submitted since the last
+    frame, then renders and writes at most one frame, and never more than
+    fps frames per second. Once max_pending changes are waiting, submit
+    blocks until the render task catches up.
+
+        live = LiveCanvas(canvas, fps=10)
+        task = asyncio.create_task(live.run())
+        await live.submit(setattr, box, "text", "busy")
+        await live.stop()
+    """
+
+    def __init__(
+        self,
+        canvas: Canvas,
+        writer: FrameWriter | None = None,
+        fps: float = 30,
+        max_pending: int = 1024,
+    ) -> None:
+        self.canvas = canvas
+        self.writer = writer or FrameWriter()
+        self.fps = fps
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self.running = False
+        self.frames = 0
+
+    async def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """Queue a change, waiting if too many are pending.
+
+        The returned future resolves to the result of the change once it has
+        been applied, or to the exception it raised.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, args, kwargs, future))
+        return future
+
+    def submit_nowait(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """Like submit, but raises asyncio.QueueFull instead of waiting"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, args, kwargs, future))
+        return future
+
+    def apply(self, change: Any):
+        fn, args, kwargs, future = change
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not future.cancelled():
+                future.set_exception(e)
+        else:
+            if not future.cancelled():
+                future.set_result(result)
+        finally:
+            self.queue.task_done()
+
+    def frame(self):
+        self.canvas.render()
+        self.writer.write(self.canvas)
+        self.frames += 1
+
+    async def run(self):
+        self.running = True
+        self.frame()
+        interval = 1 / self.fps
+        last = time.monotonic()
+        while self.running:
+            # Sleep until something changes, then let changes pile up until
+            # the next frame is due
+            change = await self.queue.get()
+            if change is None:
+                self.queue.task_done()
+                break
+            self.apply(change)
+
+            delay = last + interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.drain():
+                break
+            self.frame()
+            last = time.monotonic()
+        self.running = False
+
+    def drain(self) -> bool:
+        """Apply all pending changes, telling whether a stop was requested"""
+        while True:
+            try:
+                change = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return False
+            if change is None:
+                self.queue.task_done()
+                self.frame()
+                return True
+            self.apply(change)
+
+    async def stop(self):
+        """Stop once the changes submitted so far are applied and shown"""
+        await self.queue.put(None)
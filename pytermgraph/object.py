@@ -1,6 +1,9 @@
+import time
 from enum import Enum
-from typing import Dict, List
-from .support import Direction, Position, Step, opposite
+from typing import Dict, List, Tuple
+from .style import arrow_glyphs
+from .support import Direction, Position, Rect, Routing, heading, opposite
+from .text import layout_label, text_width
 
 arrow_head_t = "▲"
 arrow_head_b = "▼"
@@ -21,10 +24,29 @@ edge_conn_bot = "┬"
 edge_conn_top = "┴"
 
 
-# Forward declaration
+# Forward declarations
+class ObstacleRouter:
+    version: int
+
+    def invalidate(self):
+        pass
+
+    def obstacles_changed(self, changes: List[Tuple["Box", Rect]]):
+        pass
+
+    def route(self, edge: "Edge") -> List[Position]:
+        pass
+
+
+class RenderStats:
+    route_seconds: float
+
+
 class Canvas:
     width: int
     height: int
+    router: "ObstacleRouter"
+    stats: "RenderStats | None"
 
     def draw(self, string: str, position: Position, offset: Position = Position(1, 0)):
         pass
@@ -32,14 +54,81 @@ class Canvas:
     def draw_line(self, start: Position, end: Position, line_symbol: str):
         pass
 
+    def fill_rect(self, x: int, y: int, width: int, height: int, char: str):
+        pass
+
+    def connect(self, start: Position, end: Position):
+        pass
+
+    def draw_char(self, char: str, position: Position):
+        pass
+
+    def draw_glyph(self, glyph: int, position: Position):
+        pass
+
+    def sprite(self, box: "Box"):
+        pass
+
+    def keep_sprite(self, box: "Box"):
+        pass
+
+    def blit(self, sprite, position: Position):
+        pass
+
     def to_canvas_pos(self, obj: "RenderObject", pos: Position):
         pass
 
+    def invalidate(self, rect: Rect | None = None):
+        pass
+
+    def reindex(self, obj: "RenderObject"):
+        pass
+
+    def anchors_changed(self, box: "Box"):
+        pass
+
+    def edges_of(self, box: "Box") -> List["Edge"]:
+        pass
+
 
 class RenderObject:
     def __init__(self, position: Position, canvas: Canvas) -> None:
-        self.position = position
+        self._position = position
         self.canvas = canvas
+        # Stacking order, assigned by the canvas
+        self.order = 0
+
+    @property
+    def position(self) -> Position:
+        return self._position
+
+    @position.setter
+    def position(self, value: Position):
+        self.invalidate()
+        self._position = value
+        self.moved()
+
+    def bounds(self) -> Rect:
+        """Canvas area that the object draws into"""
+        raise NotImplementedError
+
+    def parts(self) -> List[Rect]:
+        """Areas covering everything the object draws, by which the canvas
+        indexes it. Thin objects leave out most of their bounds."""
+        return [self.bounds()]
+
+    def covers(self, x: int, y: int) -> bool:
+        """Whether the object draws into the cell"""
+        return self.bounds().contains(x, y)
+
+    def invalidate(self):
+        """Mark the area currently covered by the object for re-rendering"""
+        self.canvas.invalidate(self.bounds())
+
+    def moved(self):
+        """Update the canvas after the bounds of the object changed"""
+        self.canvas.reindex(self)
+        self.invalidate()
 
     def render(self):
         """Render the object into the parent canvas, based on its position"""
@@ -47,15 +136,27 @@ class RenderObject:
 
 
 class Anchor:
+    __slots__ = ("position", "obj", "edge", "side")
+
     def __init__(
         self,
         position,
         obj: RenderObject,  # Parent object
+        edge: "Edge | None" = None,
+        side: Direction = Direction.DOWN,
     ) -> None:
         self.position = position
         self.obj = obj
-        # self.edge = edge
-        pass
+        self.edge = edge
+        self.side = side
+
+    def __getstate__(self):
+        # Following edges from anchors would pickle the graph depth first,
+        # recursing once per hop. The canvas links them again on unpickling.
+        return self.position, self.obj, None, self.side
+
+    def __setstate__(self, state):
+        self.position, self.obj, self.edge, self.side = state
 
 
 class Corner(Enum):
@@ -75,135 +176,175 @@ class Edge(RenderObject):
         end_direction=Direction.VERTICAL,
         start_object: RenderObject | None = None,
         end_object: RenderObject | None = None,
+        routing: Routing = Routing.MANHATTAN,
     ) -> None:
         super().__init__(start, canvas)
-        self.start = start
-        self.end = end
+        self._start = start
+        self._end = end
         self.start_direction = start_direction
         self.end_direction = end_direction
         self.start_object = start_object
         self.end_object = end_object
+        self.routing = routing
+        self.start_anchor: Anchor | None = None
+        self.end_anchor: Anchor | None = None
+        # Points Manhattan paths go through on the way, such as the places
+        # a layout kept free for the edge
+        self.bends: List[Position] = []
+
+        self._path: List[Position] | None = None
+        self._path_version: int | None = None
+
+    @property
+    def start(self) -> Position:
+        return self._start
+
+    @start.setter
+    def start(self, value: Position):
+        self.invalidate()
+        self._start = value
+        self._position = value
+        self._path = None
+        self.moved()
+
+    @property
+    def end(self) -> Position:
+        return self._end
+
+    @end.setter
+    def end(self, value: Position):
+        self.invalidate()
+        self._end = value
+        self._path = None
+        self.moved()
+
+    def reroute(self):
+        """Route the edge again, keeping its ends"""
+        self.invalidate()
+        self._path = None
+        self.moved()
+
+    def set_endpoints(self, start: Position, end: Position):
+        """Move both ends at once, re-routing the edge only once"""
+        self.invalidate()
+        self._start = self._position = start
+        self._end = end
+        self._path = None
+        self.moved()
+
+    def bounds(self) -> Rect:
+        if self.routing == Routing.MANHATTAN and not self.bends:
+            # Manhattan paths never leave the rectangle spanned by their endpoints
+            return Rect.from_points(self._start, self._end)
+
+        path = self.route()
+        xs = [p.x for p in path]
+        ys = [p.y for p in path]
+        return Rect(min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+
+    def parts(self) -> List[Rect]:
+        path = self.route()
+        if len(path) == 1:
+            return [Rect.from_points(path[0], path[0])]
+        return [Rect.from_points(a, b) for a, b in zip(path, path[1:])]
+
+    def covers(self, x: int, y: int) -> bool:
+        path = self.route()
+        for a, b in zip(path, path[1:]):
+            if min(a.x, b.x) <= x <= max(a.x, b.x) and min(a.y, b.y) <= y <= max(
+                a.y, b.y
+            ):
+                return True
+        return path[0] == Position(x, y)
+
+    def route(self) -> List[Position]:
+        """Corner points of the edge, recomputed only after it may have changed"""
+        match self.routing:
+            case Routing.OBSTACLE:
+                version = self.canvas.router.version
+            case _:
+                version = None
+
+        if self._path is None or self._path_version != version:
+            stats = self.canvas.stats
+            start = time.perf_counter() if stats is not None else 0.0
+            match self.routing:
+                case Routing.OBSTACLE:
+                    self._path = self.canvas.router.route(self)
+                case _:
+                    self._path = self.generate_manhattan_path()
+            self._path_version = version
+            if stats is not None:
+                # Paths are mostly computed when edges are indexed, well
+                # before they are drawn
+                stats.route_seconds += time.perf_counter() - start
+        return self._path
 
     def render(self):
-        self.path = self.generate_manhattan_path()
-        for p in self.path:
-            if (
-                p.direction == Direction.LEFT
-                or p.direction == Direction.RIGHT
-                or p.direction == Direction.HORIZONTAL
-            ):
-                self.canvas.draw(edge_hori, p.position)
-            if (
-                p.direction == Direction.UP
-                or p.direction == Direction.DOWN
-                or p.direction == Direction.VERTICAL
-            ):
-                self.canvas.draw(edge_vert, p.position)
+        self.path = self.route()
 
-            prev = p.previous
-            if not prev:
-                continue
-            # NoticeChange in direction
-            if prev.direction != p.direction:
-                if prev.direction == Direction.RIGHT and p.direction == Direction.DOWN:
-                    self.canvas.draw(corner_tr, prev.position)
-                if prev.direction == Direction.RIGHT and p.direction == Direction.UP:
-                    self.canvas.draw(corner_br, prev.position)
-                if prev.direction == Direction.LEFT and p.direction == Direction.DOWN:
-                    self.canvas.draw(corner_tl, prev.position)
-                if prev.direction == Direction.LEFT and p.direction == Direction.UP:
-                    self.canvas.draw(corner_bl, prev.position)
-
-                if prev.direction == Direction.DOWN and p.direction == Direction.RIGHT:
-                    self.canvas.draw(corner_bl, prev.position)
-                if prev.direction == Direction.DOWN and p.direction == Direction.LEFT:
-                    self.canvas.draw(corner_br, prev.position)
-                if prev.direction == Direction.UP and p.direction == Direction.RIGHT:
-                    self.canvas.draw(corner_tr, prev.position)
-                if prev.direction == Direction.UP and p.direction == Direction.RIGHT:
-                    self.canvas.draw(corner_tl, prev.position)
-            if p == self.path[-1]:
-                self.canvas.draw(arrow_head_b, p.position)
-                pass
-
-    def generate_manhattan_path(self) -> List[Step]:
-        current = Step(self.start, self.start_direction)
-        path = [current]
-        dx, dy = self.end.x - self.start.x, self.end.y - self.start.y
-
-        # print(self.start.__dict__)
-        # print(self.end.__dict__)
-
-        def move(current: Step, direction) -> Step:
-            match direction:
-                case Direction.HORIZONTAL:
-                    step = 1 if dx > 0 else -1
-                    next = Step(
-                        Position(current.position.x + step, current.position.y),
-                        direction,
-                        current,
-                    )
-                case Direction.VERTICAL:
-                    step = 1 if dy > 0 else -1
-                    next = Step(
-                        Position(current.position.x, current.position.y + step),
-                        direction,
-                        current,
-                    )
-                case _:
-                    raise RuntimeError
-            assert 0 <= next.position.x <= self.canvas.width
-            assert 0 <= next.position.y <= self.canvas.height
-
-            return next
-
-        if self.start_direction != self.end_direction:
-            # Move in one direction, then the other
-            for direction in [self.start_direction, self.end_direction]:
-                while (
-                    direction == Direction.HORIZONTAL
-                    and current.position.x != self.end.x
-                ) or (
-                    direction == Direction.VERTICAL and current.position.y != self.end.y
-                ):
-                    current = move(current, direction)
-                    path.append(current)
+        # Corners and junctions with other lines come from the canvas
+        for a, b in zip(self.path, self.path[1:]):
+            self.canvas.connect(a, b)
+
+        if len(self.path) > 1:
+            direction = heading(self.path[-2], self.path[-1])
         else:
-            # Move eto midpoint, then change direction
-            mid = Position.midpoint(self.start, self.end)
-
-            for direction in [self.start_direction, opposite(self.start_direction)]:
-                while (
-                    direction == Direction.HORIZONTAL and current.position.x != mid.x
-                ) or (direction == Direction.VERTICAL and current.position.y != mid.y):
-                    current = move(current, direction)
-                    path.append(current)
-            for direction in [opposite(self.end_direction), self.end_direction]:
-                while (
-                    direction == Direction.HORIZONTAL
-                    and current.position.x != self.end.x
-                ) or (
-                    direction == Direction.VERTICAL and current.position.y != self.end.y
-                ):
-                    current = move(current, direction)
-                    path.append(current)
-
-        #
-        #
-        #     for is_horizontal in [start_horizontal, not start_horizontal]:
-        #         while (is_horizontal and current.position.x != mid_x) or (
-        #             not is_horizontal and current.position.y != mid_y
-        #         ):
-        #             move(is_horizontal)
-        #
-        #     # Complete the path
-        #     for is_horizontal in [not start_horizontal, start_horizontal]:
-        #         while (is_horizontal and current.x != self.end.x) or (
-        #             not is_horizontal and current.y != self.end.y
-        #         ):
-        #             move(is_horizontal)
-
-        return path
+            direction = Direction.DOWN
+        self.canvas.draw_glyph(arrow_glyphs[direction], self.path[-1])
+
+    def generate_manhattan_path(self) -> List[Position]:
+        """Corner points of the path. Each consecutive pair is one straight
+        segment, the first point is the start and the last one the end.
+        Bends are passed in order, entered and left along the start
+        direction."""
+        points = [self.start, *self.bends, self.end]
+        path = [self.start]
+        for i, (start, end) in enumerate(zip(points, points[1:])):
+            last = i == len(points) - 2
+            end_direction = self.end_direction if last else self.start_direction
+            path += manhattan_leg(start, end, self.start_direction, end_direction)
+        return simplify_path(path)
+
+
+def manhattan_leg(
+    start: Position, end: Position, start_direction, end_direction
+) -> List[Position]:
+    """Corners from start, excluded, to end along an L or Z shape"""
+
+    def towards(current: Position, target: Position, direction) -> Position:
+        match direction:
+            case Direction.HORIZONTAL:
+                return Position(target.x, current.y)
+            case Direction.VERTICAL:
+                return Position(current.x, target.y)
+            case _:
+                raise RuntimeError
+
+    if start.x == end.x or start.y == end.y:
+        return [end]
+    if start_direction != end_direction:
+        # Move in one direction, then the other
+        return [towards(start, end, start_direction), end]
+    # Move to the midpoint, then change direction
+    mid = Position.midpoint(start, end)
+    turn = towards(start, mid, start_direction)
+    return [turn, towards(turn, end, opposite(end_direction)), end]
+
+
+def simplify_path(path: List[Position]) -> List[Position]:
+    """Drop repeated points and points in the middle of a straight run"""
+    points = [path[0]]
+    for p in path[1:]:
+        if p == points[-1]:
+            continue
+        if len(points) > 1:
+            a, b = points[-2], points[-1]
+            if (a.x == b.x == p.x) or (a.y == b.y == p.y):
+                points[-1] = p
+                continue
+        points.append(p)
+    return points
 
 
 class Box(RenderObject):
@@ -218,7 +359,7 @@ class Box(RenderObject):
         # Note: winthin this Box class, *relative* positions are used
         self.width = width
         self.height = height
-        self.text = text
+        self._text = text
 
         self.corners = {}
         self.anchors: Dict[Direction, List[Anchor]] = {}
@@ -238,91 +379,133 @@ class Box(RenderObject):
         # self.anchors["left"].insert(Position())
         super().__init__(position, canvas)
 
-    def render(self):
-        for i in range(1, self.width - 1):
-            for j in range(1, self.height - 1):
-                self.canvas.draw(" ", self.position, Position(i, j))
-
-        # Top + bottom edges
-        self.canvas.draw_line(
-            self.canvas.to_canvas_pos(self, Position(0, 0)),
-            self.canvas.to_canvas_pos(self, Position(self.width - 1, 0)),
-            line_symbol=edge_hori,
-        )
-
-        self.canvas.draw_line(
-            self.canvas.to_canvas_pos(self, Position(0, self.height - 1)),
-            self.canvas.to_canvas_pos(self, Position(self.width - 1, self.height - 1)),
-            line_symbol=edge_hori,
-        )
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @text.setter
+    def text(self, value: str):
+        # The box keeps its bounds, only what it draws changes
+        self._text = value
+        self.invalidate()
+
+    @RenderObject.position.setter
+    def position(self, value: Position):
+        old = self.bounds()
+        RenderObject.position.fset(self, value)
+
+        # Edge ends follow the box, and the anchors of the boxes at their
+        # other ends may need a new order
+        self.canvas.anchors_changed(self)
+        for edge in self.canvas.edges_of(self):
+            for box in (edge.start_object, edge.end_object):
+                if isinstance(box, Box):
+                    self.canvas.anchors_changed(box)
+        # Edges crossing where the box was may have been drawn through it
+        self.canvas.router.obstacles_changed([(self, old), (self, self.bounds())])
+
+    def bounds(self) -> Rect:
+        # Labels are wrapped or cut short to fit inside the box
+        return Rect(self.position.x, self.position.y, self.width, self.height)
 
-        self.canvas.draw_line(
-            self.canvas.to_canvas_pos(self, Position(0, 0)),
-            self.canvas.to_canvas_pos(self, Position(0, self.height - 1)),
-            line_symbol=edge_vert,
+    def render(self):
+        # Boxes looking the same are drawn once and then copied
+        sprite = self.canvas.sprite(self)
+        if sprite is not None:
+            self.canvas.blit(sprite, self.position)
+            return
+        self.draw()
+        self.canvas.keep_sprite(self)
+
+    def draw(self):
+        # Blank the whole box, hiding anything below it, then outline it.
+        # The outline merges with edges attached to the border.
+        self.canvas.fill_rect(
+            self.position.x, self.position.y, self.width, self.height, " "
         )
 
-        self.canvas.draw_line(
-            self.canvas.to_canvas_pos(self, Position(self.width - 1, 0)),
-            self.canvas.to_canvas_pos(self, Position(self.width - 1, self.height - 1)),
-            line_symbol=edge_vert,
+        top_left = self.canvas.to_canvas_pos(self, self.corners[Corner.TOP_LEFT])
+        top_right = self.canvas.to_canvas_pos(self, self.corners[Corner.TOP_RIGHT])
+        bottom_left = self.canvas.to_canvas_pos(self, self.corners[Corner.BOTTOM_LEFT])
+        bottom_right = self.canvas.to_canvas_pos(
+            self, self.corners[Corner.BOTTOM_RIGHT]
         )
+        self.canvas.connect(top_left, top_right)
+        self.canvas.connect(bottom_left, bottom_right)
+        self.canvas.connect(top_left, bottom_left)
+        self.canvas.connect(top_right, bottom_right)
 
-        # for i in range(1, self.width - 1):
-        #     self.canvas.draw(edge_hori, self.position, Position(i, 0))
-        #     self.canvas.draw(edge_hori, self.position, Position(i, self.height - 1))
-
-        # left + right edges
-        # for i in range(1, self.height - 1):
-        #     self.canvas.draw(edge_vert, self.position, Position(0, i))
-        #     self.canvas.draw(edge_vert, self.position, Position(self.width - 1, i))
-
-        self.canvas.draw(corner_tl, self.position, self.corners[Corner.TOP_LEFT])
-        self.canvas.draw(corner_tr, self.position, self.corners[Corner.TOP_RIGHT])
-        self.canvas.draw(corner_bl, self.position, self.corners[Corner.BOTTOM_LEFT])
-        self.canvas.draw(corner_br, self.position, self.corners[Corner.BOTTOM_RIGHT])
-
-        if self.text:
-            self.canvas.draw(self.text, self.position, self.get_label_pos(self.text))
-
-    def create_anchor(self, direction: Direction) -> Anchor:
-        anchors_dir = self.anchors[direction]
+        for x, y, line in layout_label(self.text, self.width, self.height):
+            self.canvas.draw(line, self.position, Position(x, y))
 
-        size = len(anchors_dir)
-
-        step_x = self.width // (size + 2)
-        step_y = self.height // (size + 2)
+    def anchor_position(self, direction: Direction, index: int, count: int) -> Position:
+        """Position of the index-th of count anchors spread along a side"""
         match direction:
-            case Direction.DOWN:
-                offset_x = step_x
-                offset_y = self.height - 1
             case Direction.UP:
-                offset_x = step_x
-                offset_y = 0
-
-        # 1. Adjust anchor positions
-        for idx in range(size):
-            anchors_dir[idx].position.x = offset_x
-            anchors_dir[idx].position.y = offset_y
-
-            match direction:
-                case Direction.DOWN:
-                    offset_x += step_x
-                case Direction.UP:
-                    offset_x += step_x
-
-        new_anchor = Anchor(Position(offset_x, offset_y), self)
-        anchors_dir.append(new_anchor)
-        # print(anchors_dir)
-        # print(offset_x)
-
-        return new_anchor
+                return Position((index + 1) * self.width // (count + 1), 0)
+            case Direction.DOWN:
+                return Position(
+                    (index + 1) * self.width // (count + 1), self.height - 1
+                )
+            case Direction.LEFT:
+                return Position(0, (index + 1) * self.height // (count + 1))
+            case Direction.RIGHT:
+                return Position(
+                    self.width - 1, (index + 1) * self.height // (count + 1)
+                )
+            case _:
+                raise RuntimeError
+
+    def request_anchor(
+        self, direction: Direction, edge: "Edge | None" = None
+    ) -> Anchor:
+        """Add an anchor without placing it yet.
+
+        All anchors of the box are placed together by place_anchors, which the
+        canvas runs before rendering.
+        """
+        anchor = Anchor(self.anchor_position(direction, 0, 1), self, edge, direction)
+        self.anchors[direction].append(anchor)
+        self.canvas.anchors_changed(self)
+        return anchor
 
-        # Readjust
-        # return anchors_dir[size - 1]
+    def create_anchor(self, direction: Direction) -> Anchor:
+        """Add an anchor and re-space the side right away"""
+        anchor = Anchor(Position(0, 0), self, side=direction)
+        self.anchors[direction].append(anchor)
+        self.place_side(direction, reorder=False)
+        return anchor
+
+    def place_anchors(self):
+        for direction in self.anchors:
+            self.place_side(direction)
+
+    def place_side(self, direction: Direction, reorder: bool = True):
+        anchors = self.anchors[direction]
+        vertical = direction in (Direction.UP, Direction.DOWN)
+
+        def target(anchor: Anchor) -> int:
+            # Where the edge leads to, along the side. Ordering anchors by it
+            # keeps edges leaving the same side from crossing each other.
+            edge = anchor.edge
+            other = None
+            if edge is not None:
+                other = (
+                    edge.end_object if edge.start_object is self else edge.start_object
+                )
+            if isinstance(other, Box):
+                center = other.position + other.center
+            else:
+                center = self.position + anchor.position
+            return center.x if vertical else center.y
+
+        if reorder:
+            anchors.sort(key=target)
+        for i, anchor in enumerate(anchors):
+            anchor.position = self.anchor_position(direction, i, len(anchors))
 
     def get_label_pos(self, label: str) -> Position:
         # Offset from the left edge
-        label_x = self.center.x - (len(label) // 2)
+        label_x = self.center.x - (text_width(label) // 2)
         label_y = self.center.y
         return Position(label_x, label_y)
@@ -0,0 +1,126 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+from .canvas import Canvas
+from .object import Edge
+from .support import Rect
+
+# Canvas rebuilt in every worker process by init_worker
+worker_canvas: Canvas | None = None
+worker_memory: List[shared_memory.SharedMemory] = []
+
+
+def init_worker(state: bytes, array_name: str, links_name: str):
+    global worker_canvas, worker_memory
+    canvas = pickle.loads(state)
+    shape = (canvas.viewport.height, canvas.viewport.width)
+
+    array_memory = shared_memory.SharedMemory(name=array_name)
+    links_memory = shared_memory.SharedMemory(name=links_name)
+    canvas.array = np.ndarray(shape, dtype=canvas.dtype, buffer=array_memory.buf)
+    canvas.links = np.ndarray(shape, dtype=np.uint8, buffer=links_memory.buf)
+
+    worker_canvas = canvas
+    worker_memory = [array_memory, links_memory]
+
+
+def render_tile(tile: Tuple[int, int, int, int], orders: List[int]):
+    canvas = worker_canvas
+    rect = Rect(*tile)
+    objects = {o.order: o for o in canvas.render_list}
+
+    # The same steps as a full render, restricted to the tile
+    canvas.clip = rect
+    canvas.fill_rect(rect.x, rect.y, rect.width, rect.height, canvas.fill)
+    for order in orders:
+        objects[order].render()
+    canvas.resolve_links(rect)
+
+
+def tiles(canvas: Canvas, tile_width: int, tile_height: int) -> List[Rect]:
+    view = canvas.viewport
+    return [
+        Rect(x, y, min(tile_width, view.right - x), min(tile_height, view.bottom - y))
+        for y in range(view.y, view.bottom, tile_height)
+        for x in range(view.x, view.right, tile_width)
+    ]
+
+
+def render_parallel(
+    canvas: Canvas,
+    workers: int | None = None,
+    tile_width: int | None = None,
+    tile_height: int | None = None,
+):
+    """Fully render the canvas in a pool of worker processes.
+
+    The canvas is cut into tiles, and each tile only renders the objects
+    overlapping it, clipped to the tile. Workers write straight into shared
+    memory which then backs the canvas arrays, so nothing is copied back.
+    The result is the same as Canvas.render.
+    """
+    workers = workers or os.cpu_count() or 1
+    shape = (canvas.viewport.height, canvas.viewport.width)
+    tile_width = tile_width or shape[1]
+    tile_height = tile_height or max(1, -(-shape[0] // (workers * 4)))
+
+    # Place anchors and route every edge once here rather than in every
+    # worker
+    canvas.place_anchors()
+    for o in canvas.render_list:
+        if isinstance(o, Edge):
+            o.route()
+    canvas.sync_index()
+
+    array_memory = shared_memory.SharedMemory(
+        create=True, size=max(1, shape[0] * shape[1] * canvas.dtype.itemsize)
+    )
+    links_memory = shared_memory.SharedMemory(
+        create=True, size=max(1, shape[0] * shape[1])
+    )
+    try:
+        work = []
+        for rect in tiles(canvas, tile_width, tile_height):
+            orders = [o.order for o in canvas.query(rect)]
+            work.append(((rect.x, rect.y, rect.width, rect.height), orders))
+
+        state = pickle.dumps(canvas)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(state, array_memory.name, links_memory.name),
+        ) as pool:
+            for future in [pool.submit(render_tile, *w) for w in work]:
+                future.result()
+    except BaseException:
+        for memory in (array_memory, links_memory):
+            memory.close()
+            memory.unlink()
+        raise
+
+    array = np.ndarray(shape, dtype=canvas.dtype, buffer=array_memory.buf)
+    links = np.ndarray(shape, dtype=np.uint8, buffer=links_memory.buf)
+    if canvas.storage is not None:
+        # Keep the cells in their file
+        canvas.array[...] = array
+        canvas.links[...] = links
+        del array, links
+        for memory in (array_memory, links_memory):
+            memory.close()
+            memory.unlink()
+    else:
+        # The mappings stay alive through the canvas. Unlinking only drops
+        # their names.
+        array_memory.unlink()
+        links_memory.unlink()
+        canvas.array = array
+        canvas.links = links
+        canvas.shared_memory = [array_memory, links_memory]
+
+    canvas.needs_full_render = False
+    canvas.dirty.clear()
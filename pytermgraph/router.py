@@ -0,0 +1,587 @@
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .layout import ranges
+from .object import Box, Edge, simplify_path
+from .support import Direction, Position, Rect, Routing
+
+# Extra cost of a turn, in cells. Keeps routes made of few long runs.
+BEND_PENALTY = 4
+
+# Edges routed together, bounding the size of the arrays
+BATCH_SIZE = 512
+
+# Arrays derived from the boxes, rebuilt on demand
+RASTERS = (
+    "occupancy",
+    "col_sums",
+    "row_sums",
+    "run_starts",
+    "run_ends",
+    "run_ids",
+    "run_bounds",
+    "crossing",
+    "scratch",
+)
+
+
+class ObstacleRouter:
+    """Routes edges around the boxes of a canvas.
+
+    The boxes are rasterized into an occupancy bitmap which is kept until a
+    box is added, moved or removed. Edges are routed in batches: every place
+    to turn of routes with two and then four bends is checked for all edges
+    of a batch at once, against prefix sums and free runs of the bitmap.
+    Only the few edges left over are searched for one by one, from both
+    ends over the free runs, so that each search stays near its edge.
+    """
+
+    def __init__(self, canvas) -> None:
+        self.canvas = canvas
+        self.version = 0
+        self.occupancy: np.ndarray | None = None
+        self.has_routes = False
+
+    def __getstate__(self):
+        # The bitmap is rebuilt on demand
+        state = self.__dict__.copy()
+        for key in RASTERS:
+            state.pop(key, None)
+        state["occupancy"] = None
+        return state
+
+    def invalidate(self):
+        """Drop the cached bitmap, after the set of obstacles changed"""
+        self.occupancy = None
+        self.version += 1
+        if self.has_routes:
+            # Any routed edge may now take another way
+            self.canvas.routes_changed()
+
+    def obstacles_changed(self, changes: List[Tuple[Box, Rect]]):
+        """Drop the cached bitmap after boxes were added, moved or removed,
+        like invalidate, but only re-route the edges crossing the areas of
+        the changed boxes. Other routes are kept, even where a box left room
+        for a shorter one.
+        """
+        self.occupancy = None
+        if not self.has_routes:
+            return
+        for box, rect in changes:
+            for o in self.canvas.query(rect):
+                if not isinstance(o, Edge) or o.routing != Routing.OBSTACLE:
+                    continue
+                if box in (o.start_object, o.end_object):
+                    continue
+                path = o.route()
+                if any(
+                    Rect.from_points(a, b).intersects(rect)
+                    for a, b in zip(path, path[1:])
+                ):
+                    o.reroute()
+
+    def build(self):
+        occupancy = np.zeros((self.canvas.height, self.canvas.width), dtype=bool)
+        for o in self.canvas.render_list:
+            if isinstance(o, Box):
+                x, y = max(o.position.x, 0), max(o.position.y, 0)
+                occupancy[y : o.position.y + o.height, x : o.position.x + o.width] = (
+                    True
+                )
+
+        self.occupancy = occupancy
+        occ = occupancy.astype(np.int32)
+        # col_sums[y, x] is the number of occupied cells above (x, y), and
+        # row_sums[y, x] the number left of it
+        self.col_sums = np.zeros((occ.shape[0] + 1, occ.shape[1]), dtype=np.int32)
+        np.cumsum(occ, axis=0, out=self.col_sums[1:])
+        self.row_sums = np.zeros((occ.shape[0], occ.shape[1] + 1), dtype=np.int32)
+        np.cumsum(occ, axis=1, out=self.row_sums[:, 1:])
+        # Built when a route first needs more than two bends
+        self.run_ids = None
+
+    def route(self, edge: Edge) -> List[Position]:
+        return self.paths([edge])[0]
+
+    def route_all(self, edges: Iterable[Edge]):
+        """Route the obstacle-routed edges whose paths are out of date, all
+        in one go, and keep the paths on the edges"""
+        stale = [
+            e
+            for e in edges
+            if e.routing == Routing.OBSTACLE
+            and (e._path is None or e._path_version != self.version)
+        ]
+        if not stale:
+            return
+        stats = self.canvas.stats
+        start = time.perf_counter() if stats is not None else 0.0
+        for edge, path in zip(stale, self.paths(stale)):
+            edge._path = path
+            edge._path_version = self.version
+        if stats is not None:
+            stats.route_seconds += time.perf_counter() - start
+
+    def paths(self, edges: Sequence[Edge]) -> List[List[Position]]:
+        """Routes of the edges.
+
+        Edges are taken in batches, and every place to turn is checked for
+        all edges of a batch at once, first for routes with two bends and
+        then for routes with four. Only edges with neither are searched for
+        one by one.
+        """
+        if self.occupancy is None:
+            self.build()
+        self.has_routes = True
+        height, width = self.occupancy.shape
+
+        def inside(p: Position):
+            return 0 <= p.x < width and 0 <= p.y < height
+
+        found: List[List[Position] | None] = [None] * len(edges)
+        routable = [i for i, e in enumerate(edges) if inside(e.start) and inside(e.end)]
+        for vertical in (True, False):
+            batch = [
+                i
+                for i in routable
+                if (edges[i].start_direction == Direction.VERTICAL) == vertical
+            ]
+            for first in range(0, len(batch), BATCH_SIZE):
+                part = batch[first : first + BATCH_SIZE]
+                routes = self.route_batch([edges[i] for i in part], vertical)
+                for i, path in zip(part, routes):
+                    found[i] = path
+        for i in routable:
+            if found[i] is None:
+                found[i] = self.route_runs(edges[i])
+
+        paths = []
+        for edge, path in zip(edges, found):
+            if path is None:
+                # Boxed in, draw through the obstacles rather than not at all
+                paths.append(edge.generate_manhattan_path())
+            else:
+                paths.append(simplify_path(path))
+        return paths
+
+    def route_batch(
+        self, edges: Sequence[Edge], vertical: bool
+    ) -> List[List[Position] | None]:
+        """Routes with two or four bends of edges leaving their start along
+        the same axis, or None for those with neither"""
+        # Work in (major, minor) coordinates, where routes leave the start
+        # along the major axis. Transposing the bitmap and its sums handles
+        # horizontal starts.
+        points = np.array(
+            [(e.start.x, e.start.y, e.end.x, e.end.y) for e in edges], dtype=np.int64
+        )
+        if vertical:
+            s_minor, s_major, e_minor, e_major = points.T
+            occupancy = self.occupancy
+            major_sums, minor_sums = self.col_sums, self.row_sums
+        else:
+            s_major, s_minor, e_major, e_minor = points.T
+            occupancy = self.occupancy.T
+            major_sums, minor_sums = self.row_sums.T, self.col_sums.T
+
+        # Only the endpoints themselves may touch an obstacle
+        allowed = occupancy[s_major, s_minor].astype(np.int64)
+        allowed += occupancy[e_major, e_minor] & (points[:, :2] != points[:, 2:]).any(1)
+
+        turns = self.two_bends(
+            s_major, s_minor, e_major, e_minor, allowed, major_sums, minor_sums
+        )
+        routes: List[List[Position] | None] = [None] * len(edges)
+        left = []
+        for i, t in enumerate(turns.tolist()):
+            if t < 0:
+                left.append(i)
+                continue
+            sM, sm, eM, em = s_major[i], s_minor[i], e_major[i], e_minor[i]
+            routes[i] = [(sM, sm), (t, sm), (t, em), (eM, em)]
+
+        if left:
+            left = np.array(left)
+            found = self.four_bends(
+                s_major[left],
+                s_minor[left],
+                e_major[left],
+                e_minor[left],
+                vertical,
+                occupancy,
+                major_sums,
+            )
+            for i, route in zip(left.tolist(), found):
+                routes[i] = route
+
+        def position(major, minor):
+            return (
+                Position(int(minor), int(major))
+                if vertical
+                else Position(int(major), int(minor))
+            )
+
+        return [
+            None if route is None else [position(*p) for p in route] for route in routes
+        ]
+
+    def two_bends(
+        self, s_major, s_minor, e_major, e_minor, allowed, major_sums, minor_sums
+    ) -> np.ndarray:
+        """Where along the major axis each route turns, for routes that run
+        along it, across and along it again, or -1 where none is clear"""
+        size = minor_sums.shape[0]
+        t = np.arange(size)
+        s_major, s_minor, e_major, e_minor = (
+            a[:, None] for a in (s_major, s_minor, e_major, e_minor)
+        )
+
+        def run(line, a):
+            # Occupied cells from a up to, but not including, t on a line
+            # along the major axis
+            lo = np.where(t > a, a, t + 1)
+            hi = np.where(t > a, t - 1, a)
+            return major_sums[hi + 1, line] - major_sums[lo, line]
+
+        # The two legs leave out the turning cells, which the crossing covers
+        lo, hi = np.minimum(s_minor, e_minor), np.maximum(s_minor, e_minor)
+        blocked = (
+            run(s_minor, s_major)
+            + minor_sums[t, hi + 1]
+            - minor_sums[t, lo]
+            + run(e_minor, e_major)
+        )
+        clear = blocked == allowed[:, None]
+
+        length = np.abs(t - s_major) + np.abs(t - e_major)
+        bends = (t != s_major).astype(np.int64) + (t != e_major)
+        bends[s_minor[:, 0] == e_minor[:, 0]] = 0
+        cost = (length + BEND_PENALTY * bends) * 2 * size
+        # Prefer turning half way between the endpoints
+        cost += np.abs(2 * t - s_major - e_major)
+        cost[~clear] = np.iinfo(cost.dtype).max
+
+        best = np.argmin(cost, axis=1)
+        return np.where(clear[np.arange(len(best)), best], best, -1)
+
+    def four_bends(
+        self, s_major, s_minor, e_major, e_minor, vertical, occupancy, major_sums
+    ) -> List[List[Tuple[int, int]] | None]:
+        """Routes that leave the start along the major axis, cross to a lane
+        along it, follow that lane and cross again to enter the end along
+        the major axis, as (major, minor) corners. Such routes get around
+        boxes in the way, and leave boxes on the side away from the end.
+        """
+        if self.run_ids is None:
+            self.build_runs()
+        size, minor_size = occupancy.shape
+        along = 1 if vertical else 0
+        major_ids, minor_ids = self.run_ids[along], self.run_ids[1 - along]
+        if not vertical:
+            major_ids, minor_ids = major_ids.T, minor_ids.T
+        major_first, major_last = self.run_bounds[along]
+        minor_first, minor_last = self.run_bounds[1 - along]
+
+        def span(major, minor):
+            # Free cells along the major axis on either side of an end
+            before = np.where(major > 0, major_ids[np.maximum(major - 1, 0), minor], -1)
+            after = np.where(
+                major < size - 1, major_ids[np.minimum(major + 1, size - 1), minor], -1
+            )
+            lo = np.where(before >= 0, major_first[before], major)
+            hi = np.where(after >= 0, major_last[after], major)
+            return lo, hi
+
+        c = np.arange(minor_size)
+
+        def reach(lo, hi, own, minor, other_lo, other_hi):
+            # For every lane along the major axis, the place to turn in the
+            # span of an end nearest to the span of the other end from which
+            # the crossing gets there, or -1. Every crossing covers the end's
+            # own lane, so the lanes reached by the first k places to turn
+            # are those between the least first and greatest last cell of
+            # their crossings.
+            before = other_hi < lo
+            anchor = np.where(
+                other_lo > hi, hi, np.where(before, lo, np.minimum(hi, other_hi))
+            )
+            step = np.where(before, 1, -1)
+            count = int((hi - lo).max()) + 1
+            t = anchor[:, None] + step[:, None] * np.arange(count)
+            valid = (t >= lo[:, None]) & (t <= hi[:, None]) & (t != own[:, None])
+            t = np.clip(t, 0, size - 1)
+            runs = minor_ids[t, minor[:, None]]
+            first = np.where(valid, minor_first[runs], minor_size)
+            last = np.where(valid, minor_last[runs], -1)
+
+            # Index of the first place to turn reaching each lane. The least
+            # first and greatest last cells change at few places to turn;
+            # each such place is the first to reach the lanes up to its
+            # value, and the running minimum over the lanes fills the rest.
+            right = np.maximum.accumulate(last, axis=1)
+            left = np.minimum.accumulate(first, axis=1)
+            right_steps = (
+                right > np.pad(right, ((0, 0), (1, 0)), constant_values=-1)[:, :-1]
+            )
+            left_steps = (
+                left
+                < np.pad(left, ((0, 0), (1, 0)), constant_values=minor_size)[:, :-1]
+            )
+            k = np.full((len(t), 2, minor_size + 1), count)
+            rows, ks = np.nonzero(right_steps)
+            k[rows, 0, minor_size - right[rows, ks]] = ks
+            rows, ks = np.nonzero(left_steps)
+            k[rows, 1, left[rows, ks]] = ks
+            k = np.minimum.accumulate(k, axis=2)
+            k = np.where(c >= minor[:, None], k[:, 0, minor_size - c], k[:, 1, c])
+            found = k < count
+            return np.where(
+                found, t[np.arange(len(t))[:, None], np.minimum(k, count - 1)], -1
+            )
+
+        s_lo, s_hi = span(s_major, s_minor)
+        e_lo, e_hi = span(e_major, e_minor)
+        t1 = reach(s_lo, s_hi, s_major, s_minor, e_lo, e_hi)
+        t2 = reach(e_lo, e_hi, e_major, e_minor, s_lo, s_hi)
+
+        # The lane must be clear between the two crossings
+        lo, hi = np.minimum(t1, t2), np.maximum(t1, t2)
+        clear = (t1 >= 0) & (t2 >= 0)
+        clear &= major_sums[hi + 1, c] == major_sums[np.maximum(lo, 0), c]
+
+        s_major, s_minor, e_major, e_minor = (
+            a[:, None] for a in (s_major, s_minor, e_major, e_minor)
+        )
+        length = np.abs(t1 - s_major) + np.abs(t2 - t1) + np.abs(e_major - t2)
+        length += np.abs(c - s_minor) + np.abs(e_minor - c)
+        cost = length * 2 * minor_size + np.abs(2 * c - s_minor - e_minor)
+        cost[~clear] = np.iinfo(cost.dtype).max
+
+        rows = np.arange(len(cost))
+        best = np.argmin(cost, axis=1)
+        ok = clear[rows, best].tolist()
+        corners = zip(
+            s_major[:, 0].tolist(),
+            s_minor[:, 0].tolist(),
+            t1[rows, best].tolist(),
+            best.tolist(),
+            t2[rows, best].tolist(),
+            e_minor[:, 0].tolist(),
+            e_major[:, 0].tolist(),
+        )
+        return [
+            (
+                [(sM, sm), (a, sm), (a, lane), (b, lane), (b, em), (eM, em)]
+                if found
+                else None
+            )
+            for found, (sM, sm, a, lane, b, em, eM) in zip(ok, corners)
+        ]
+
+    def build_runs(self):
+        # Maximal free runs of cells along rows (orientation 0) and columns
+        # (orientation 1). Cells of a row run are consecutive in row-major
+        # order, and those of a column run in column-major order.
+        free = ~self.occupancy
+        h_id, h_start, h_end = free_runs(free)
+        v_id_t, v_start, v_end = free_runs(free.T)
+        self.run_starts = (h_start, v_start)
+        self.run_ends = (h_end, v_end)
+        # Run of each orientation at every cell, row-major
+        self.run_ids = (h_id, np.ascontiguousarray(v_id_t.T))
+        # First and last cell of every run, along its axis
+        height, width = free.shape
+        self.run_bounds = (
+            (h_start % width, (h_end - 1) % width),
+            (v_start % height, (v_end - 1) % height),
+        )
+        # Run of the other orientation at every cell of a run, in the order
+        # of the run's own cells
+        self.crossing = (self.run_ids[1].ravel(), np.ascontiguousarray(h_id.T).ravel())
+        # Slot per run, for searches to find repeats in
+        self.scratch = tuple(
+            np.empty(len(starts), dtype=np.int64) for starts in (h_start, v_start)
+        )
+
+    def route_runs(self, edge: Edge) -> List[Position] | None:
+        """Route with the fewest bends, searched from both ends at once.
+
+        The two searches take turns, the one with the fewer cells to look at
+        going first, until a run reached by one is reached by the other. Each
+        thus stays near its own end, where a search from the start alone
+        would sweep most of the canvas before reaching the end.
+        """
+        if self.run_ids is None:
+            self.build_runs()
+        start, end = edge.start, edge.end
+        height, width = self.occupancy.shape
+
+        def near(p: Position, orientation):
+            # The cell itself if free, or else its free neighbours along the axis
+            if not self.occupancy[p.y, p.x]:
+                return [(p.x, p.y)]
+            dx, dy = (1, 0) if orientation == 0 else (0, 1)
+            cells = [(p.x - dx, p.y - dy), (p.x + dx, p.y + dy)]
+            return [(x, y) for x, y in cells if 0 <= x < width and 0 <= y < height]
+
+        first = 1 if edge.start_direction == Direction.VERTICAL else 0
+        forward = RunSearch(self, {first: near(start, first)})
+        backward = RunSearch(self, {o: near(end, o) for o in (0, 1)})
+
+        hits = forward.meet(backward)
+        while not hits:
+            search = min(forward, backward, key=RunSearch.size)
+            if not search.expand():
+                return None
+            hits = forward.meet(backward)
+
+        # Of the runs joining the searches with the fewest bends, go through
+        # the one nearest to both ends
+        orientation, runs, _ = min(hits, key=lambda hit: hit[2])
+        bends = forward.levels[orientation][runs] + backward.levels[orientation][runs]
+        runs = runs[bends == bends.min()]
+        x0, y0, x1, y1 = self.run_extents(runs, orientation)
+        detour = sum(
+            np.maximum(x0 - p.x, 0)
+            + np.maximum(p.x - x1, 0)
+            + np.maximum(y0 - p.y, 0)
+            + np.maximum(p.y - y1, 0)
+            for p in (start, end)
+        )
+        best = int(np.argmin(detour))
+        run = int(runs[best])
+
+        # Head along the run towards the end
+        towards = Position(
+            min(max(end.x, int(x0[best])), int(x1[best])),
+            min(max(end.y, int(y0[best])), int(y1[best])),
+        )
+        there = forward.trace(run, orientation, towards)
+        back = backward.trace(run, orientation, there[0])
+        return [start] + there[::-1] + back + [end]
+
+    def run_extents(self, runs: np.ndarray, orientation: int):
+        """Left, top, right and bottom cells of the runs"""
+        height, width = self.occupancy.shape
+        first = self.run_starts[orientation][runs]
+        last = self.run_ends[orientation][runs] - 1
+        if orientation == 0:
+            return first % width, first // width, last % width, last // width
+        return first // height, first % height, last // height, last % height
+
+    def run_cells(self, runs: np.ndarray, orientation: int) -> np.ndarray:
+        """Cells of the runs, as indices in the runs' own order"""
+        starts = self.run_starts[orientation][runs]
+        return ranges(starts, self.run_ends[orientation][runs] - starts)
+
+
+class RunSearch:
+    """Search over the free runs of a router's bitmap from one end of an
+    edge, one bend at a time.
+
+    Level k holds the runs reached with k bends. The runs of the next level
+    are those crossing any cell of the current one, which NumPy finds for a
+    whole level at once.
+    """
+
+    def __init__(self, router: ObstacleRouter, cells: Dict[int, List[Tuple[int, int]]]):
+        self.router = router
+        # Level of every run of each orientation, or -1 until reached
+        self.levels = [
+            np.full(len(router.run_starts[o]), -1, dtype=np.int32) for o in (0, 1)
+        ]
+        # Cell next to the end of each run of level 0
+        self.seeds: Tuple[Dict[int, Tuple[int, int]], ...] = ({}, {})
+        for o, points in cells.items():
+            for x, y in points:
+                run = int(router.run_ids[o][y, x])
+                if run >= 0:
+                    self.seeds[o].setdefault(run, (x, y))
+        self.frontier = [np.array(list(self.seeds[o]), dtype=np.int64) for o in (0, 1)]
+        for o in (0, 1):
+            self.levels[o][self.frontier[o]] = 0
+        self.level = 0
+        self.cells = self.count_cells()
+
+    def count_cells(self) -> int:
+        router = self.router
+        return sum(
+            int((router.run_ends[o][runs] - router.run_starts[o][runs]).sum())
+            for o, runs in enumerate(self.frontier)
+        )
+
+    def size(self) -> int:
+        """Cells to look at to reach the next level"""
+        return self.cells
+
+    def expand(self) -> bool:
+        """Reach the next level, or return False if there is nothing left"""
+        router = self.router
+        self.level += 1
+        frontier = [self.frontier[0], self.frontier[1]]
+        for o in (0, 1):
+            crossing = router.crossing[o][router.run_cells(self.frontier[o], o)]
+            levels = self.levels[1 - o]
+            crossing = crossing[levels[crossing] < 0]
+            # Keep one of each repeated run, without sorting
+            order = np.arange(len(crossing))
+            slots = router.scratch[1 - o]
+            slots[crossing] = order
+            crossing = crossing[slots[crossing] == order]
+            levels[crossing] = self.level
+            frontier[1 - o] = crossing
+        self.frontier = frontier
+        self.cells = self.count_cells()
+        return bool(len(frontier[0]) or len(frontier[1]))
+
+    def meet(self, other: "RunSearch") -> List[Tuple[int, np.ndarray, int]]:
+        """Runs reached by both searches, as (orientation, runs, bends) for
+        each orientation that has any, where bends is the fewest needed"""
+        hits = []
+        for o in (0, 1):
+            for a, b in ((self, other), (other, self)):
+                runs = a.frontier[o]
+                runs = runs[b.levels[o][runs] >= 0]
+                if len(runs):
+                    bends = self.levels[o][runs] + other.levels[o][runs]
+                    hits.append((o, runs, int(bends.min())))
+        return hits
+
+    def trace(self, run: int, orientation: int, point: Position) -> List[Position]:
+        """Turns from the run back to the end the search started from, the
+        first on the run being the nearest to point"""
+        router = self.router
+        height, width = router.occupancy.shape
+        x, y = point.x, point.y
+        path = []
+        o = orientation
+        for k in range(int(self.levels[o][run]), 0, -1):
+            cells = router.run_cells(np.array([run]), o)
+            crossing = router.crossing[o][cells]
+            turns = np.flatnonzero(self.levels[1 - o][crossing] == k - 1)
+            if o == 0:
+                xs, ys = cells[turns] % width, cells[turns] // width
+                best = int(np.argmin(np.abs(xs - x)))
+            else:
+                xs, ys = cells[turns] // height, cells[turns] % height
+                best = int(np.argmin(np.abs(ys - y)))
+            x, y = int(xs[best]), int(ys[best])
+            path.append(Position(x, y))
+            run = int(crossing[turns[best]])
+            o = 1 - o
+        path.append(Position(*self.seeds[o][run]))
+        return path
+
+
+def free_runs(free: np.ndarray):
+    """Run of every cell of the rows, -1 on occupied cells, and the first
+    and past-the-end flat index of every run"""
+    begins = free.copy()
+    begins[:, 1:] &= ~free[:, :-1]
+    ends = free.copy()
+    ends[:, :-1] &= ~free[:, 1:]
+    ids = np.cumsum(begins.ravel(), dtype=np.int32) - 1
+    ids[~free.ravel()] = -1
+    return ids.reshape(free.shape), np.flatnonzero(begins), np.flatnonzero(ends) + 1
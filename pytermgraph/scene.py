@@ -0,0 +1,269 @@
+"""Save laid-out and routed canvases, and open them again without redoing
+any of that work.
+
+A scene is a directory of .npy files, which can all be memory-mapped:
+
+    meta.json     canvas size, fill, routing and style
+    boxes.npy     one record per box: rectangle, label slice and order
+    labels.npy    code points of all labels, end to end
+    edges.npy     one record per edge: ends, anchors, path slice and order
+    paths.npy     corner points of all edge paths, end to end
+
+Loading a window of a scene builds only the objects in it. The other
+records are only scanned, a column at a time, to find them.
+"""
+
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from .canvas import Canvas, to_codepoints
+from .object import Anchor, Box, Edge, RenderObject
+from .style import STYLES
+from .support import Direction, Position, Rect, Routing
+
+# Bump whenever the files change meaning
+SCENE_VERSION = 1
+
+DIRECTIONS = list(Direction)
+ROUTINGS = list(Routing)
+
+BOX_DTYPE = np.dtype(
+    [
+        ("x", "<i4"),
+        ("y", "<i4"),
+        ("width", "<i4"),
+        ("height", "<i4"),
+        ("label_start", "<i8"),
+        ("label_end", "<i8"),
+        ("order", "<i8"),
+    ]
+)
+
+EDGE_DTYPE = np.dtype(
+    [
+        # Index of the box at each end, or -1
+        ("start_box", "<i4"),
+        ("end_box", "<i4"),
+        ("start", "<i4", 2),
+        ("end", "<i4", 2),
+        ("start_direction", "i1"),
+        ("end_direction", "i1"),
+        ("routing", "i1"),
+        # Side and position within the box of each anchor, or -1
+        ("start_side", "i1"),
+        ("end_side", "i1"),
+        ("start_anchor", "<i4", 2),
+        ("end_anchor", "<i4", 2),
+        ("path_start", "<i8"),
+        ("path_end", "<i8"),
+        ("order", "<i8"),
+    ]
+)
+
+
+def save_scene(canvas: Canvas, directory: str):
+    """Write the objects of the canvas, and the routes of its edges"""
+    # Routes and anchors are saved as they would be rendered
+    canvas.sync_index()
+
+    boxes = [o for o in canvas.render_list if isinstance(o, Box)]
+    edges = [o for o in canvas.render_list if isinstance(o, Edge)]
+    box_ids = {box: i for i, box in enumerate(boxes)}
+
+    box_records = np.zeros(len(boxes), dtype=BOX_DTYPE)
+    labels = []
+    offset = 0
+    for i, box in enumerate(boxes):
+        codes = to_codepoints(box.text)
+        box_records[i] = (
+            box.position.x,
+            box.position.y,
+            box.width,
+            box.height,
+            offset,
+            offset + len(codes),
+            box.order,
+        )
+        labels.append(codes)
+        offset += len(codes)
+
+    edge_records = np.zeros(len(edges), dtype=EDGE_DTYPE)
+    paths = []
+    offset = 0
+    for i, edge in enumerate(edges):
+        path = edge.route()
+        record = edge_records[i]
+        record["start_box"] = box_ids.get(edge.start_object, -1)
+        record["end_box"] = box_ids.get(edge.end_object, -1)
+        record["start"] = (edge.start.x, edge.start.y)
+        record["end"] = (edge.end.x, edge.end.y)
+        record["start_direction"] = DIRECTIONS.index(edge.start_direction)
+        record["end_direction"] = DIRECTIONS.index(edge.end_direction)
+        record["routing"] = ROUTINGS.index(edge.routing)
+        for end, anchor in (("start", edge.start_anchor), ("end", edge.end_anchor)):
+            if anchor is None:
+                record[f"{end}_side"] = -1
+            else:
+                record[f"{end}_side"] = DIRECTIONS.index(anchor.side)
+                record[f"{end}_anchor"] = (anchor.position.x, anchor.position.y)
+        record["path_start"] = offset
+        record["path_end"] = offset + len(path)
+        record["order"] = edge.order
+        paths.append([(p.x, p.y) for p in path])
+        offset += len(path)
+
+    os.makedirs(directory, exist_ok=True)
+    style = next((name for name, s in STYLES.items() if s is canvas.style), None)
+    meta = {
+        "version": SCENE_VERSION,
+        "width": canvas.width,
+        "height": canvas.height,
+        "fill": canvas.fill,
+        "routing": canvas.routing.name,
+        "style": style,
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    np.save(os.path.join(directory, "boxes.npy"), box_records)
+    np.save(
+        os.path.join(directory, "labels.npy"),
+        np.concatenate(labels) if labels else np.zeros(0, dtype="<u4"),
+    )
+    np.save(os.path.join(directory, "edges.npy"), edge_records)
+    np.save(
+        os.path.join(directory, "paths.npy"),
+        np.array([p for path in paths for p in path], dtype="<i4").reshape(-1, 2),
+    )
+
+
+def load_scene(
+    directory: str, mmap: bool = True, area: Rect | None = None, **kwargs
+) -> Canvas:
+    """Canvas of a saved scene, ready to render without routing again.
+
+    Only the objects overlapping the area are built, with the boxes their
+    edges join, so that a window of a large scene opens without reading
+    the rest of it. The area defaults to the viewport, if one is given, and
+    otherwise to the whole scene. Further keyword arguments are passed to
+    the Canvas.
+    """
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("version") != SCENE_VERSION:
+        raise ValueError(f"unsupported scene version {meta.get('version')}")
+
+    mode = "r" if mmap else None
+    box_records = np.load(os.path.join(directory, "boxes.npy"), mmap_mode=mode)
+    labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode=mode)
+    edge_records = np.load(os.path.join(directory, "edges.npy"), mmap_mode=mode)
+    paths = np.load(os.path.join(directory, "paths.npy"), mmap_mode=mode)
+
+    if meta["style"] is not None:
+        kwargs.setdefault("style", STYLES[meta["style"]])
+    canvas = Canvas(
+        meta["width"],
+        meta["height"],
+        meta["fill"],
+        routing=Routing[meta["routing"]],
+        **kwargs,
+    )
+    if area is None:
+        area = kwargs.get("viewport")
+    # Objects added later go on top of all saved ones, built or not
+    orders = [int(r["order"].max()) for r in (box_records, edge_records) if len(r)]
+    next_order = max(orders) + 1 if orders else 0
+
+    # Pick the records to build from their columns, before reading any of
+    # them whole
+    box_ids = np.arange(len(box_records))
+    edge_ids = np.arange(len(edge_records))
+    if area is not None:
+        x, y = box_records["x"], box_records["y"]
+        box_ids = box_ids[
+            overlaps(area, x, y, x + box_records["width"], y + box_records["height"])
+        ]
+        if len(edge_records):
+            # Paths hold every cell an edge draws, arrows included
+            starts = edge_records["path_start"]
+            low = np.minimum.reduceat(paths, starts, axis=0)
+            high = np.maximum.reduceat(paths, starts, axis=0) + 1
+            edge_ids = edge_ids[
+                overlaps(area, low[:, 0], low[:, 1], high[:, 0], high[:, 1])
+            ]
+    edge_records = edge_records[edge_ids]
+    ends = np.concatenate([edge_records["start_box"], edge_records["end_box"]])
+    box_ids = np.union1d(box_ids, ends[ends >= 0])
+
+    boxes: Dict[int, Box] = {}
+    for i, (x, y, width, height, label_start, label_end, order) in zip(
+        box_ids.tolist(), box_records[box_ids].tolist()
+    ):
+        label = (
+            labels[label_start:label_end].astype("<u4").tobytes().decode("utf-32-le")
+        )
+        box = Box(canvas, width, height, Position(x, y), label)
+        box.order = order
+        boxes[i] = box
+    objects: List[RenderObject] = list(boxes.values())
+
+    version = canvas.router.version
+    for record in edge_records:
+        start_box, end_box = int(record["start_box"]), int(record["end_box"])
+        routing = ROUTINGS[record["routing"]]
+        edge = Edge(
+            canvas,
+            Position(*record["start"].tolist()),
+            Position(*record["end"].tolist()),
+            DIRECTIONS[record["start_direction"]],
+            DIRECTIONS[record["end_direction"]],
+            boxes.get(start_box),
+            boxes.get(end_box),
+            routing,
+        )
+        edge.order = int(record["order"])
+        for end, box in (("start", edge.start_object), ("end", edge.end_object)):
+            side = int(record[f"{end}_side"])
+            if side < 0:
+                continue
+            anchor = Anchor(
+                Position(*record[f"{end}_anchor"].tolist()), box, edge, DIRECTIONS[side]
+            )
+            box.anchors[anchor.side].append(anchor)
+            setattr(edge, f"{end}_anchor", anchor)
+
+        # The saved route stands until the obstacles change
+        path = paths[int(record["path_start"]) : int(record["path_end"])].tolist()
+        edge._path = [Position(x, y) for x, y in path]
+        edge._path_version = version if routing == Routing.OBSTACLE else None
+        objects.append(edge)
+
+    # Anchors were saved in their placed order along each side
+    for box in boxes.values():
+        for side, anchors in box.anchors.items():
+            vertical = side in (Direction.UP, Direction.DOWN)
+            anchors.sort(key=lambda a: a.position.x if vertical else a.position.y)
+
+    objects.sort(key=lambda o: o.order)
+    canvas.render_list = objects
+    canvas.next_order = next_order
+    for o in objects:
+        canvas.index.insert(o, o.parts())
+        if isinstance(o, Edge):
+            for box in {o.start_object, o.end_object}:
+                if box is not None:
+                    canvas.incident.setdefault(box, {})[o] = None
+    if any(o.routing == Routing.OBSTACLE for o in objects if isinstance(o, Edge)):
+        canvas.router.has_routes = True
+    return canvas
+
+
+def overlaps(area: Rect, left, top, right, bottom) -> np.ndarray:
+    """Which of the rectangles, given by the arrays of their sides, overlap
+    the area"""
+    return (
+        (left < area.right) & (area.x < right) & (top < area.bottom) & (area.y < bottom)
+    )
@@ -0,0 +1,109 @@
+from typing import Dict, Hashable, List, Sequence, Set, Tuple
+
+from .support import Rect
+
+# Side of the finest square buckets, in cells
+CELL_SIZE = 16
+# Each level of buckets is this many times coarser than the one before
+LEVEL_RATIO = 16
+LEVELS = 3
+# Buckets a part may fall in before it goes to a coarser level
+MAX_BUCKETS = 8
+
+
+class SpatialIndex:
+    """Grids of buckets, each holding the objects overlapping it.
+
+    Lookups only visit the buckets under the queried area, so hit tests and
+    overlap queries cost the same whatever the number of objects. Objects
+    are indexed by the parts of the canvas they draw into, such as the
+    segments of an edge. Each part goes to the finest grid where it falls in
+    only a few buckets, so long edges take few buckets rather than one per
+    cell-sized square along them.
+    """
+
+    def __init__(self, cell_size: int = CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        self.sizes = [cell_size * LEVEL_RATIO**level for level in range(LEVELS)]
+        # Keyed by level and bucket column and row
+        self.buckets: Dict[Tuple[int, int, int], Dict[Hashable, None]] = {}
+        self.rects: Dict[Hashable, Sequence[Rect]] = {}
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, obj: Hashable):
+        return obj in self.rects
+
+    def cells(self, rect: Rect, level: int):
+        size = self.sizes[level]
+        for by in range(rect.y // size, (rect.bottom - 1) // size + 1):
+            for bx in range(rect.x // size, (rect.right - 1) // size + 1):
+                yield level, bx, by
+
+    def level(self, rect: Rect) -> int:
+        """Grid that a part is kept in"""
+        for level, size in enumerate(self.sizes):
+            columns = (rect.right - 1) // size - rect.x // size + 1
+            rows = (rect.bottom - 1) // size - rect.y // size + 1
+            if columns * rows <= MAX_BUCKETS:
+                return level
+        return LEVELS - 1
+
+    def insert(self, obj: Hashable, rects: Sequence[Rect]):
+        self.rects[obj] = rects
+        for rect in rects:
+            if rect.is_empty():
+                continue
+            for cell in self.cells(rect, self.level(rect)):
+                # Dicts are used as ordered sets
+                self.buckets.setdefault(cell, {})[obj] = None
+
+    def remove(self, obj: Hashable):
+        rects = self.rects.pop(obj, None)
+        if rects is None:
+            return
+        for rect in rects:
+            if rect.is_empty():
+                continue
+            for cell in self.cells(rect, self.level(rect)):
+                bucket = self.buckets.get(cell)
+                if bucket is None or obj not in bucket:
+                    # Already left by another part sharing the bucket
+                    continue
+                del bucket[obj]
+                if not bucket:
+                    del self.buckets[cell]
+
+    def update(self, obj: Hashable, rects: Sequence[Rect]):
+        old = self.rects.get(obj)
+        if old is not None and list(old) == list(rects):
+            return
+        self.remove(obj)
+        self.insert(obj, rects)
+
+    def query(self, rect: Rect) -> Set[Hashable]:
+        """Objects with a part intersecting the area"""
+        found: Set[Hashable] = set()
+        if rect.is_empty():
+            return found
+        for level in range(LEVELS):
+            for cell in self.cells(rect, level):
+                bucket = self.buckets.get(cell)
+                if bucket:
+                    found.update(
+                        o
+                        for o in bucket
+                        if o not in found
+                        and any(r.intersects(rect) for r in self.rects[o])
+                    )
+        return found
+
+    def at(self, x: int, y: int) -> List[Hashable]:
+        """Objects with a part containing the cell"""
+        found: Dict[Hashable, None] = {}
+        for level, size in enumerate(self.sizes):
+            for o in self.buckets.get((level, x // size, y // size), ()):
+                if any(r.contains(x, y) for r in self.rects[o]):
+                    found[o] = None
+        return list(found)
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from typing import Hashable, Tuple
+
+import numpy as np
+
+# Cells and link bits of a rendered object
+Sprite = Tuple[np.ndarray, np.ndarray]
+
+
+class SpriteCache:
+    """Recently rendered boxes, by everything their cells depend on.
+
+    Styles are applied on output, so one sprite serves every style.
+    """
+
+    def __init__(self, capacity: int = 256) -> None:
+        self.capacity = capacity
+        self.entries: "OrderedDict[Hashable, Sprite]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Sprite | None:
+        sprite = self.entries.get(key)
+        if sprite is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return sprite
+
+    def put(self, key: Hashable, sprite: Sprite):
+        self.entries[key] = sprite
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,181 @@
+import time
+from collections import defaultdict
+from typing import Callable, Dict
+
+from .object import Edge, RenderObject
+from .support import Position, Rect
+from .text import text_width
+
+# Canvas methods wrapped by Canvas.instrument
+PRIMITIVES = [
+    "draw",
+    "draw_char",
+    "draw_glyph",
+    "draw_line",
+    "fill_rect",
+    "connect",
+    "blit",
+]
+
+
+class RenderStats:
+    """Counters filled in by an instrumented canvas"""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        self.renders = 0
+        self.render_seconds = 0.0
+        # Time spent placing anchors and re-pointing edges at them, which
+        # includes routing the edges moved
+        self.anchor_seconds = 0.0
+        # Time spent computing edge paths, wherever they are computed
+        self.route_seconds = 0.0
+        # Time spent rendering each object
+        self.object_seconds: Dict[RenderObject, float] = defaultdict(float)
+        # Number of cells along each edge path
+        self.path_lengths: Dict[Edge, int] = {}
+
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.cells_written = 0
+
+    def seconds_by_type(self) -> Dict[str, float]:
+        totals: Dict[str, float] = defaultdict(float)
+        for obj, seconds in self.object_seconds.items():
+            totals[type(obj).__name__] += seconds
+        return dict(totals)
+
+    def summary(self) -> str:
+        lines = [
+            f"renders: {self.renders} in {self.render_seconds:.4f}s",
+            f"anchors: {self.anchor_seconds:.4f}s",
+            f"routes: {self.route_seconds:.4f}s",
+        ]
+        for name, seconds in sorted(self.seconds_by_type().items()):
+            lines.append(f"{name} render: {seconds:.4f}s")
+        for name, count in sorted(self.calls.items()):
+            lines.append(f"{name}: {count} calls")
+        lines.append(f"cells written: {self.cells_written}")
+        if self.path_lengths:
+            lengths = list(self.path_lengths.values())
+            lines.append(
+                f"edge paths: {len(lengths)}, "
+                f"longest {max(lengths)}, total {sum(lengths)} cells"
+            )
+        return "\n".join(lines)
+
+
+def path_length(path) -> int:
+    return 1 + sum(abs(a.x - b.x) + abs(a.y - b.y) for a, b in zip(path, path[1:]))
+
+
+def instrument(
+    canvas,
+    stats: RenderStats,
+    on_object: Callable[[RenderObject, float], None] | None = None,
+):
+    """Shadow the canvas methods with counting versions.
+
+    The wrappers are set on the instance only, so an uninstrumented canvas
+    runs the plain class methods with no extra cost.
+    """
+
+    def cells(rect: Rect) -> int:
+        rect = rect.intersection(canvas.clip)
+        return 0 if rect.is_empty() else rect.width * rect.height
+
+    def count(name, fn, area):
+        def wrapper(*args, **kwargs):
+            stats.calls[name] += 1
+            stats.cells_written += area(*args, **kwargs)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def draw_area(text, position, offset=Position(0, 0)):
+        width = text_width(text)
+        return cells(Rect(position.x + offset.x, position.y + offset.y, width, 1))
+
+    def char_area(char, position, offset=Position(0, 0)):
+        return cells(Rect(position.x + offset.x, position.y + offset.y, 1, 1))
+
+    def glyph_area(glyph, position, offset=Position(0, 0)):
+        return char_area(glyph, position, offset)
+
+    def line_area(start, end, line_symbol):
+        # Drawn up to, but not including, the end
+        if start.x != end.x and start.y != end.y:
+            return abs(end.x - start.x)
+        return max(cells(Rect.from_points(start, end)) - 1, 0)
+
+    def rect_area(x, y, width, height, char):
+        return cells(Rect(x, y, width, height))
+
+    def connect_area(start, end):
+        return 0 if start == end else cells(Rect.from_points(start, end))
+
+    def blit_area(sprite, position):
+        height, width = sprite[0].shape
+        return cells(Rect(position.x, position.y, width, height))
+
+    areas = {
+        "draw": draw_area,
+        "draw_char": char_area,
+        "draw_glyph": glyph_area,
+        "draw_line": line_area,
+        "fill_rect": rect_area,
+        "connect": connect_area,
+        "blit": blit_area,
+    }
+    for name in PRIMITIVES:
+        method = getattr(type(canvas), name).__get__(canvas)
+        setattr(canvas, name, count(name, method, areas[name]))
+
+    render = type(canvas).render.__get__(canvas)
+
+    def timed_render():
+        start = time.perf_counter()
+        render()
+        stats.renders += 1
+        stats.render_seconds += time.perf_counter() - start
+
+    def timed_render_objects(objects):
+        for o in objects:
+            if isinstance(o, Edge):
+                stats.path_lengths[o] = path_length(o.route())
+
+            start = time.perf_counter()
+            o.render()
+            seconds = time.perf_counter() - start
+            stats.object_seconds[o] += seconds
+            if on_object is not None:
+                on_object(o, seconds)
+
+    draw_edge_boxes = type(canvas).draw_edge_boxes.__get__(canvas)
+    place_anchors = type(canvas).place_anchors.__get__(canvas)
+
+    def timed_draw_edge_boxes(*args, **kwargs):
+        start = time.perf_counter()
+        edge = draw_edge_boxes(*args, **kwargs)
+        stats.anchor_seconds += time.perf_counter() - start
+        return edge
+
+    def timed_place_anchors():
+        start = time.perf_counter()
+        place_anchors()
+        stats.anchor_seconds += time.perf_counter() - start
+
+    canvas.render = timed_render
+    canvas.render_objects = timed_render_objects
+    canvas.draw_edge_boxes = timed_draw_edge_boxes
+    canvas.place_anchors = timed_place_anchors
+
+
+# Every attribute set by instrument
+WRAPPED = PRIMITIVES + ["render", "render_objects", "draw_edge_boxes", "place_anchors"]
+
+
+def uninstrument(canvas):
+    for name in WRAPPED:
+        canvas.__dict__.pop(name, None)
@@ -1,9 +1,88 @@
-from pytermgraph.support import Direction
+from typing import Dict
+
+import numpy as np
+
+from pytermgraph.support import (
+    LINK_DOWN,
+    LINK_LEFT,
+    LINK_RIGHT,
+    LINK_UP,
+    Direction,
+)
+
+# Canvas cells hold either a code point, or one of these glyph IDs, which
+# are turned into characters by a style only when the canvas is output.
+# IDs 1 to 15 are lines, numbered by the LINK_* bits of the directions they
+# lead to, so that merged link bits are glyph IDs as they are.
+VERTICAL = LINK_UP | LINK_DOWN
+HORIZONTAL = LINK_LEFT | LINK_RIGHT
+CORNER_TL = LINK_DOWN | LINK_RIGHT
+CORNER_TR = LINK_DOWN | LINK_LEFT
+CORNER_BL = LINK_UP | LINK_RIGHT
+CORNER_BR = LINK_UP | LINK_LEFT
+TEE_RIGHT = LINK_UP | LINK_DOWN | LINK_RIGHT
+TEE_LEFT = LINK_UP | LINK_DOWN | LINK_LEFT
+TEE_DOWN = LINK_LEFT | LINK_RIGHT | LINK_DOWN
+TEE_UP = LINK_LEFT | LINK_RIGHT | LINK_UP
+CROSS = LINK_UP | LINK_DOWN | LINK_LEFT | LINK_RIGHT
+
+ARROW_UP = 16
+ARROW_DOWN = 17
+ARROW_LEFT = 18
+ARROW_RIGHT = 19
+
+# Second cell of a wide character, taken up by the character in the cell
+# before it. Output skips these cells.
+CONTINUATION = 20
+
+# Cells below this value are glyph IDs. Control characters are never drawn,
+# so they are free to be used as IDs.
+GLYPH_COUNT = 32
+
+arrow_glyphs = {
+    Direction.UP: ARROW_UP,
+    Direction.DOWN: ARROW_DOWN,
+    Direction.LEFT: ARROW_LEFT,
+    Direction.RIGHT: ARROW_RIGHT,
+}
+
+glyph_names = {
+    "horizontal": [HORIZONTAL, LINK_LEFT, LINK_RIGHT],
+    "vertical": [VERTICAL, LINK_UP, LINK_DOWN],
+    "down_right": [CORNER_TL],
+    "down_left": [CORNER_TR],
+    "up_right": [CORNER_BL],
+    "up_left": [CORNER_BR],
+    "vertical_left": [TEE_LEFT],
+    "vertical_right": [TEE_RIGHT],
+    "horizontal_up": [TEE_UP],
+    "horizontal_down": [TEE_DOWN],
+    "cross": [CROSS],
+    "arrow_up": [ARROW_UP],
+    "arrow_down": [ARROW_DOWN],
+    "arrow_left": [ARROW_LEFT],
+    "arrow_right": [ARROW_RIGHT],
+}
 
 
 class Style:
-    def __init__(self) -> None:
-        pass
+    """Characters of the glyph IDs, applied to a whole canvas at once"""
+
+    def __init__(self, characters: Dict[str, str]) -> None:
+        self.characters = characters
+        self.table = np.arange(GLYPH_COUNT, dtype=np.uint32)
+        for name, char in characters.items():
+            self.table[glyph_names[name]] = ord(char)
+
+    def apply(self, cells: np.ndarray) -> np.ndarray:
+        """Code points of the cells"""
+        out = cells.astype(np.uint32)
+        glyphs = out < GLYPH_COUNT
+        out[glyphs] = self.table[out[glyphs]]
+        return out
+
+    def char(self, cell: int) -> str:
+        return chr(self.table[cell] if cell < GLYPH_COUNT else cell)
 
 
 LIGHT_STYLE = {
@@ -17,8 +96,79 @@ LIGHT_STYLE = {
     "vertical_right": "├",
     "horizontal_up": "┴",
     "horizontal_down": "┬",
+    "cross": "┼",
     "arrow_up": "▲",
     "arrow_down": "▼",
     "arrow_left": "◀",
     "arrow_right": "▶",
 }
+
+HEAVY_STYLE = {
+    **LIGHT_STYLE,
+    "horizontal": "━",
+    "vertical": "┃",
+    "down_right": "┏",
+    "down_left": "┓",
+    "up_right": "┗",
+    "up_left": "┛",
+    "vertical_left": "┫",
+    "vertical_right": "┣",
+    "horizontal_up": "┻",
+    "horizontal_down": "┳",
+    "cross": "╋",
+}
+
+DOUBLE_STYLE = {
+    **LIGHT_STYLE,
+    "horizontal": "═",
+    "vertical": "║",
+    "down_right": "╔",
+    "down_left": "╗",
+    "up_right": "╚",
+    "up_left": "╝",
+    "vertical_left": "╣",
+    "vertical_right": "╠",
+    "horizontal_up": "╩",
+    "horizontal_down": "╦",
+    "cross": "╬",
+}
+
+ROUNDED_STYLE = {
+    **LIGHT_STYLE,
+    "down_right": "╭",
+    "down_left": "╮",
+    "up_right": "╰",
+    "up_left": "╯",
+}
+
+ASCII_STYLE = {
+    "horizontal": "-",
+    "vertical": "|",
+    "down_right": "+",
+    "down_left": "+",
+    "up_right": "+",
+    "up_left": "+",
+    "vertical_left": "+",
+    "vertical_right": "+",
+    "horizontal_up": "+",
+    "horizontal_down": "+",
+    "cross": "+",
+    "arrow_up": "^",
+    "arrow_down": "v",
+    "arrow_left": "<",
+    "arrow_right": ">",
+}
+
+LIGHT = Style(LIGHT_STYLE)
+HEAVY = Style(HEAVY_STYLE)
+DOUBLE = Style(DOUBLE_STYLE)
+ROUNDED = Style(ROUNDED_STYLE)
+ASCII = Style(ASCII_STYLE)
+
+STYLES = {
+    "light": LIGHT,
+    "heavy": HEAVY,
+    "double": DOUBLE,
+    "rounded": ROUNDED,
+    "ascii": ASCII,
+}
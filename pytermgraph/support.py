@@ -1,4 +1,7 @@
 from enum import Enum
+from typing import Iterable, Iterator, NamedTuple
+
+import numpy as np
 
 arrow_head_t = "▲"
 arrow_head_b = "▼"
@@ -16,47 +19,100 @@ edge_vert = "│"
 edge_conn_right = "├"
 edge_conn_left = "┤"
 edge_conn_bot = "┬"
-edge_conn_top = "┬"
+edge_conn_top = "┴"
+edge_conn_cross = "┼"
 
+# Line connectivity of a cell: which neighbours its glyph reaches out to
+LINK_UP = 1
+LINK_DOWN = 2
+LINK_LEFT = 4
+LINK_RIGHT = 8
 
-class Position:
-    def __init__(self, x: int, y: int, z: int = 0):
-        self.x = x
-        self.y = y
-        self.z = z
+
+class Position(NamedTuple):
+    """Cell coordinates. Positions are values: immutable and hashable, so
+    they can be shared freely and used as dict and set keys. z is carried
+    through arithmetic but, like before, ignored by comparisons.
+
+    Positions only compare, add and multiply with other positions and with
+    integers, never as the tuples they are stored as.
+    """
+
+    x: int
+    y: int
+    z: int = 0
 
     def __add__(self, other):
         if isinstance(other, Position):
-            return Position(self.x + other.x, self.y + other.y)
+            return Position(self.x + other.x, self.y + other.y, self.z + other.z)
         if isinstance(other, int):
-            return Position(self.x + other, self.y + other)
+            return Position(self.x + other, self.y + other, self.z)
         else:
             raise TypeError
 
     def __sub__(self, other):
         if isinstance(other, Position):
-            return Position(self.x - other.x, self.y - other.y)
+            return Position(self.x - other.x, self.y - other.y, self.z - other.z)
         if isinstance(other, int):
-            return Position(self.x - other, self.y - other)
+            return Position(self.x - other, self.y - other, self.z)
         else:
             raise TypeError
 
     def __floordiv__(self, other):
         if isinstance(other, Position):
-            return Position(self.x // other.x, self.y // other.y)
+            return Position(self.x // other.x, self.y // other.y, self.z)
         if isinstance(other, int):
-            return Position(self.x // other, self.y // other)
+            return Position(self.x // other, self.y // other, self.z)
         else:
             raise TypeError
 
     def __eq__(self, other):
+        # Not NotImplemented, which would fall back to comparing tuples
+        if not isinstance(other, Position):
+            return False
         return self.x == other.x and self.y == other.y
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    def _keys(self, other) -> tuple:
+        # Ordering is by (x, y), consistent with equality
+        if not isinstance(other, Position):
+            raise TypeError(f"cannot compare Position and {type(other).__name__}")
+        return (self.x, self.y), (other.x, other.y)
+
+    def __lt__(self, other):
+        a, b = self._keys(other)
+        return a < b
+
+    def __le__(self, other):
+        a, b = self._keys(other)
+        return a <= b
+
+    def __gt__(self, other):
+        a, b = self._keys(other)
+        return a > b
+
+    def __ge__(self, other):
+        a, b = self._keys(other)
+        return a >= b
+
+    def __radd__(self, other):
+        # Would otherwise concatenate tuples
+        raise TypeError(f"cannot add Position to {type(other).__name__}")
+
+    def __rmul__(self, other):
+        # Would otherwise repeat the tuple
+        raise TypeError(f"cannot multiply {type(other).__name__} by Position")
+
     def __mul__(self, other):
         if isinstance(other, Position):
-            return Position(self.x * other.x, self.y * other.y)
+            return Position(self.x * other.x, self.y * other.y, self.z)
         if isinstance(other, int):
-            return Position(self.x * other, self.y * other)
+            return Position(self.x * other, self.y * other, self.z)
         else:
             raise TypeError
 
@@ -71,7 +127,122 @@ class Position:
 
     @classmethod
     def midpoint(cls, a, b):
-        return (a + b) // 2
+        return Position((a.x + b.x) // 2, (a.y + b.y) // 2, a.z)
+
+
+class PositionArray:
+    """Many positions as coordinate arrays, transformed all at once"""
+
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z=None) -> None:
+        self.x = np.asarray(x, dtype=np.int64)
+        self.y = np.asarray(y, dtype=np.int64)
+        self.z = np.zeros_like(self.x) if z is None else np.asarray(z, dtype=np.int64)
+
+    @classmethod
+    def from_positions(cls, positions: Iterable[Position]) -> "PositionArray":
+        coords = np.array([tuple(p) for p in positions], dtype=np.int64).reshape(-1, 3)
+        return cls(coords[:, 0], coords[:, 1], coords[:, 2])
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, i: int) -> Position:
+        return Position(int(self.x[i]), int(self.y[i]), int(self.z[i]))
+
+    def __iter__(self) -> Iterator[Position]:
+        return map(Position, self.x.tolist(), self.y.tolist(), self.z.tolist())
+
+    def __add__(self, other) -> "PositionArray":
+        if isinstance(other, (Position, PositionArray)):
+            return PositionArray(self.x + other.x, self.y + other.y, self.z + other.z)
+        if isinstance(other, int):
+            return PositionArray(self.x + other, self.y + other, self.z)
+        else:
+            raise TypeError
+
+    def __sub__(self, other) -> "PositionArray":
+        if isinstance(other, (Position, PositionArray)):
+            return PositionArray(self.x - other.x, self.y - other.y, self.z - other.z)
+        if isinstance(other, int):
+            return PositionArray(self.x - other, self.y - other, self.z)
+        else:
+            raise TypeError
+
+    def bounds(self) -> "Rect":
+        if not len(self):
+            return Rect(0, 0, 0, 0)
+        x0, y0 = int(self.x.min()), int(self.y.min())
+        return Rect(x0, y0, int(self.x.max()) - x0 + 1, int(self.y.max()) - y0 + 1)
+
+
+class Rect:
+    __slots__ = ("x", "y", "width", "height")
+
+    def __init__(self, x: int, y: int, width: int, height: int):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    @property
+    def right(self) -> int:
+        # Exclusive
+        return self.x + self.width
+
+    @property
+    def bottom(self) -> int:
+        # Exclusive
+        return self.y + self.height
+
+    def is_empty(self) -> bool:
+        return self.width <= 0 or self.height <= 0
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.x <= x < self.right and self.y <= y < self.bottom
+
+    def intersects(self, other: "Rect") -> bool:
+        return (
+            self.x < other.right
+            and other.x < self.right
+            and self.y < other.bottom
+            and other.y < self.bottom
+        )
+
+    def intersection(self, other: "Rect") -> "Rect":
+        x = max(self.x, other.x)
+        y = max(self.y, other.y)
+        return Rect(
+            x,
+            y,
+            max(0, min(self.right, other.right) - x),
+            max(0, min(self.bottom, other.bottom) - y),
+        )
+
+    def union(self, other: "Rect") -> "Rect":
+        x = min(self.x, other.x)
+        y = min(self.y, other.y)
+        return Rect(
+            x, y, max(self.right, other.right) - x, max(self.bottom, other.bottom) - y
+        )
+
+    @classmethod
+    def from_points(cls, a: Position, b: Position) -> "Rect":
+        # Smallest rectangle covering both cells
+        x, y = min(a.x, b.x), min(a.y, b.y)
+        return cls(x, y, abs(a.x - b.x) + 1, abs(a.y - b.y) + 1)
+
+    def __eq__(self, other):
+        return (
+            self.x == other.x
+            and self.y == other.y
+            and self.width == other.width
+            and self.height == other.height
+        )
+
+    def __hash__(self):
+        return hash((self.x, self.y, self.width, self.height))
 
 
 class Direction(Enum):
@@ -89,6 +260,13 @@ class Direction(Enum):
     VERTICAL = "vertical"
 
 
+class Routing(Enum):
+    # Straight L or Z shaped paths, ignoring everything on the canvas
+    MANHATTAN = "manhattan"
+    # Paths around the boxes on the canvas
+    OBSTACLE = "obstacle"
+
+
 def opposite(direction: Direction):
     match direction:
         case Direction.UP:
@@ -105,28 +283,46 @@ def opposite(direction: Direction):
             return Direction.VERTICAL
 
 
-class Step:
-    def __init__(
-        self,
+def heading(a: Position, b: Position) -> Direction:
+    """Direction of travel along the axis-aligned segment from a to b"""
+    if b.x > a.x:
+        return Direction.RIGHT
+    if b.x < a.x:
+        return Direction.LEFT
+    if b.y > a.y:
+        return Direction.DOWN
+    return Direction.UP
+
+
+class StepBase(NamedTuple):
+    position: Position
+    direction: Direction
+    previous: "Step | None"
+
+
+class Step(StepBase):
+    """One cell of a path, linked to the cell before it"""
+
+    __slots__ = ()
+
+    def __new__(
+        cls,
         position: Position,
         direction: Direction = Direction.HORIZONTAL,
         previous: "Step | None" = None,
     ):
-        self.previous = previous
-        self.position = position
-        self.direction = direction
-
         if previous:
-            diff = self.position - previous.position
+            diff = position - previous.position
             assert not (diff.x == 0 ^ diff.y == 0)
             if diff.x > 0:
-                self.direction = Direction.RIGHT
+                direction = Direction.RIGHT
             elif diff.x < 0:
-                self.direction = Direction.LEFT
+                direction = Direction.LEFT
             elif diff.y > 0:
-                self.direction = Direction.DOWN
+                direction = Direction.DOWN
             elif diff.y < 0:
-                self.direction = Direction.UP
+                direction = Direction.UP
+        return super().__new__(cls, position, direction, previous)
 
 
 # def get_next_char(current, next, direction) -> str:
@@ -0,0 +1,103 @@
+import sys
+from typing import TextIO
+
+import numpy as np
+
+from .canvas import Canvas
+from .text import wide_halves
+
+CLEAR_SCREEN = "\x1b[2J"
+
+# Unchanged cells between two changed runs of a row are rewritten rather than
+# skipped when that is shorter than moving the cursor past them
+MERGE_GAP = 8
+
+
+def move_to(row: int, column: int) -> str:
+    return f"\x1b[{row + 1};{column + 1}H"
+
+
+class FrameWriter:
+    """Writes canvas frames to a terminal, sending only what changed.
+
+    The last written frame is kept and every new one is compared with it
+    cell by cell. Changed cells are grouped into runs per row, and each run
+    is written with a single cursor move, so the output grows with the size
+    of the change rather than the size of the canvas.
+    """
+
+    def __init__(self, stream: TextIO | None = None, row: int = 0, column: int = 0):
+        self.stream = stream or sys.stdout
+        # Screen cell of the top left corner of the canvas
+        self.row = row
+        self.column = column
+
+        self.previous: np.ndarray | None = None
+        self.bytes_written = 0
+
+    def reset(self):
+        """Redraw everything on the next write, e.g. after the screen was cleared"""
+        self.previous = None
+
+    def write(self, canvas: Canvas):
+        frame = canvas.frame()
+        halves = wide_halves(frame)
+        skip = None
+        if halves is not None:
+            blank, skip = halves
+            frame[blank] = ord(" ")
+        if self.previous is None or self.previous.shape != frame.shape:
+            out = self.full(frame, skip)
+        else:
+            out = self.diff(frame, skip)
+        self.previous = frame.copy()
+
+        if out:
+            self.stream.write(out)
+            self.stream.flush()
+            self.bytes_written += len(out.encode())
+
+    def full(self, frame: np.ndarray, skip: np.ndarray | None = None) -> str:
+        """Whole frame, leaving out the cells in skip"""
+        out = [CLEAR_SCREEN]
+        for y in range(frame.shape[0]):
+            out.append(move_to(self.row + y, self.column))
+            out.append(text(frame[y], None if skip is None else skip[y]))
+        return "".join(out)
+
+    def diff(self, frame: np.ndarray, skip: np.ndarray | None = None) -> str:
+        height, width = frame.shape
+        # A blank column after every row keeps runs from wrapping around
+        changed = np.zeros((height, width + 1), dtype=bool)
+        np.not_equal(frame, self.previous, out=changed[:, :width])
+
+        flat = np.concatenate(([False], changed.ravel(), [False]))
+        bounds = np.flatnonzero(flat[1:] != flat[:-1])
+        starts, ends = bounds[::2], bounds[1::2]
+        if not len(starts):
+            return ""
+
+        # Join runs of the same row separated by short gaps
+        rows = starts // (width + 1)
+        join = (starts[1:] - ends[:-1] <= MERGE_GAP) & (rows[1:] == rows[:-1])
+        starts = starts[np.concatenate(([True], ~join))]
+        ends = ends[np.concatenate((~join, [True]))]
+
+        out = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            y, x = divmod(start, width + 1)
+            if skip is not None and skip[y, x]:
+                # Rewrite the wide character the run starts in
+                x -= 1
+                start -= 1
+            run = slice(x, x + end - start)
+            out.append(move_to(self.row + y, self.column + x))
+            out.append(text(frame[y, run], None if skip is None else skip[y, run]))
+        return "".join(out)
+
+
+def text(cells: np.ndarray, skip: np.ndarray | None = None) -> str:
+    if skip is not None:
+        # Wide characters move the cursor past their continuation cell
+        cells = cells[~skip]
+    return cells.astype("<u4").tobytes().decode("utf-32-le")
@@ -0,0 +1,186 @@
+"""Display widths of text, and the layout of labels inside boxes.
+
+Terminals show most characters in one cell, East Asian wide characters
+and most emoji in two, and combining marks in none. Labels are measured
+with a table of the width of every code point, filled in from unicodedata
+a block at a time as code points are first seen.
+"""
+
+import unicodedata
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+
+from .style import CONTINUATION
+
+# No character below this is wide
+WIDE_MIN = 0x1100
+
+# Distinct labels whose measurements are kept
+LABEL_CACHE_SIZE = 4096
+
+# Ends a label cut short to fit its box
+ELLIPSIS = "…"
+
+BLOCK_BITS = 8
+UNKNOWN = 255
+# Width of every code point, or UNKNOWN until its block is looked up
+widths = np.full(0x110000, UNKNOWN, dtype=np.uint8)
+
+
+def char_width(code: int) -> int:
+    if code < 0x20 or 0x7F <= code < 0xA0:
+        return 0
+    char = chr(code)
+    if code != 0xAD and unicodedata.category(char) in ("Mn", "Me", "Cf"):
+        return 0
+    if 0x1160 <= code < 0x1200:
+        # Hangul vowels and final consonants join the syllable before them
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ("W", "F") else 1
+
+
+def fill_block(block: int):
+    start = block << BLOCK_BITS
+    codes = range(start, min(start + (1 << BLOCK_BITS), len(widths)))
+    widths[start : codes.stop] = [char_width(code) for code in codes]
+
+
+def code_widths(codes: np.ndarray) -> np.ndarray:
+    """Display width of each code point"""
+    out = widths[codes]
+    unknown = out == UNKNOWN
+    if unknown.any():
+        for block in np.unique(codes[unknown] >> BLOCK_BITS).tolist():
+            fill_block(block)
+        out = widths[codes]
+    return out
+
+
+def wide_halves(cells: np.ndarray) -> Tuple[np.ndarray, np.ndarray] | None:
+    """Cells to show as spaces, and cells to skip, when writing rows of
+    cells out, or None if there are neither.
+
+    A wide character and the continuation after it take up two cells, so
+    the continuation is skipped. Where something was drawn over one of the
+    two, the other is shown as a space to keep the columns in place. Works
+    on cells holding glyph IDs and on cells a style was applied to alike.
+    """
+    continued = cells == CONTINUATION
+    possibly_wide = cells >= WIDE_MIN
+    if not continued.any() and not possibly_wide.any():
+        return None
+
+    # Continuations in the first column lost their character to a crop
+    orphan = continued.copy()
+    before = continued[:, 1:]
+    orphan[:, 1:][before] = code_widths(cells[:, :-1][before]) != 2
+    lead = possibly_wide
+    lead[:, :-1] &= ~continued[:, 1:]
+    lead[lead] = code_widths(cells[lead]) == 2
+    return orphan | lead, continued & ~orphan
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def text_cells(text: str) -> np.ndarray:
+    """Cells showing the text: one per character, and a CONTINUATION cell
+    after each wide one. Combining marks are composed with the character
+    before them where Unicode allows, and dropped otherwise."""
+    codes = np.frombuffer(
+        unicodedata.normalize("NFC", text).encode("utf-32-le"), dtype="<u4"
+    )
+    if len(codes) and codes.max() < 0x7F and codes.min() >= 0x20:
+        # Printable ASCII
+        cells = codes.copy()
+    else:
+        w = code_widths(codes)
+        cells = np.repeat(codes, w)
+        # The second cell of each wide character
+        ends = np.cumsum(w)
+        cells[ends[w == 2] - 1] = CONTINUATION
+    cells.flags.writeable = False
+    return cells
+
+
+def text_width(text: str) -> int:
+    """Number of cells the text takes on a terminal"""
+    return len(text_cells(text))
+
+
+def fit(text: str, width: int) -> str:
+    """Longest start of the text no wider than width, keeping wide
+    characters whole"""
+    if text_width(text) <= width:
+        return text
+    text = unicodedata.normalize("NFC", text)
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+    ends = np.cumsum(code_widths(codes))
+    return text[: int(np.searchsorted(ends, width, side="right"))]
+
+
+def truncate(text: str, width: int) -> str:
+    """The text, cut short with an ellipsis if it is wider than width"""
+    if text_width(text) <= width:
+        return text
+    if width < 1:
+        return ""
+    return fit(text, width - 1).rstrip() + ELLIPSIS
+
+
+def wrap(text: str, width: int) -> list[str]:
+    """Lines of the text no wider than width, broken between words where
+    possible, and within words that are too wide on their own"""
+    lines: list[str] = []
+    line = ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if text_width(candidate) <= width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        while text_width(word) > width:
+            head = fit(word, width)
+            if not head:
+                # Not even one character fits
+                return lines
+            lines.append(head)
+            word = word[len(head) :]
+        line = word
+    if line:
+        lines.append(line)
+    return lines
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def layout_label(
+    text: str, width: int, height: int
+) -> Tuple[Tuple[int, int, str], ...]:
+    """Lines of a label in a box of the given size, as (x, y, line) with
+    the offset of each line from the corner of the box.
+
+    Lines are centred in the box, inside its border. A label too wide for
+    one line is wrapped, and cut short with an ellipsis if it still does
+    not fit.
+    """
+    inner_width, inner_height = width - 2, height - 2
+    if not text or inner_width < 1 or inner_height < 1:
+        return ()
+
+    if text_width(text) <= inner_width:
+        lines = [text]
+    else:
+        rest = unicodedata.normalize("NFC", " ".join(text.split()))
+        lines = wrap(rest, inner_width) if inner_height > 1 else []
+        # Whatever does not fit goes into the last line
+        lines = lines[: min(len(lines), inner_height) - 1]
+        for line in lines:
+            rest = rest[len(line) :].lstrip()
+        lines.append(truncate(rest, inner_width))
+
+    top = height // 2 - len(lines) // 2
+    return tuple(
+        (width // 2 - text_width(line) // 2, top + i, line)
+        for i, line in enumerate(lines)
+    )